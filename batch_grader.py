@@ -0,0 +1,221 @@
+"""
+Evaluación por lotes (sin interfaz) de directorios completos de entregas.
+
+Procesa cada entrega con `prepare_context_from_files` y el mismo prompt que
+/nota, en paralelo y bajo el limitador de tokens. Los resultados se escriben
+en JSONL a medida que terminan, así que si el proceso cae basta con relanzar
+el mismo comando: las entregas ya evaluadas se saltan.
+
+Uso:
+    python batch_grader.py --input entregas/ --output notas.jsonl --workers 4
+    python batch_grader.py --manifest lote.jsonl --output notas.jsonl
+    python batch_grader.py --input entregas/ --batch-api-file lote_openai.jsonl
+
+El manifiesto JSONL admite por línea: {"id": ..., "path": ..., "question": ...}
+(solo "path" es obligatorio). Con --batch-api-file no se llama a la API: se
+genera el fichero de entrada para la Batch API de OpenAI.
+"""
+
+import argparse
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+from file_processor import prepare_context_from_files
+
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt", ".md", ".csv", ".xlsx", ".xls", ".jpg", ".jpeg", ".png", ".webp")
+
+_GRADE_RE = re.compile(r"\b(\d{1,2}(?:[.,]\d{1,2})?)\s*/\s*10\b")
+
+
+def discover_jobs(input_dir: Optional[str], manifest: Optional[str]) -> List[Dict]:
+    """Lista de trabajos {"id", "path", "question"} desde un directorio o un manifiesto."""
+    jobs: List[Dict] = []
+    if manifest:
+        with open(manifest, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                path = item["path"]
+                jobs.append({"id": str(item.get("id") or path), "path": path, "question": item.get("question")})
+    if input_dir:
+        for folder, _, files in os.walk(input_dir):
+            for name in sorted(files):
+                if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    path = os.path.join(folder, name)
+                    jobs.append({"id": os.path.relpath(path, input_dir), "path": path, "question": None})
+    return jobs
+
+
+def completed_ids(output_path: str) -> Set[str]:
+    """Ids ya evaluados con éxito en un JSONL previo (tolera una última línea cortada)."""
+    done: Set[str] = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+
+def load_attachments(path: str) -> List[Dict]:
+    """Lee un fichero del disco y lo procesa como una subida de Streamlit."""
+    with open(path, "rb") as f:
+        upload = io.BytesIO(f.read())
+    upload.name = os.path.basename(path)
+    return prepare_context_from_files([upload])
+
+
+def extract_grade(text: str) -> Optional[float]:
+    """Nota numérica (x/10) mencionada en la evaluación, si la hay."""
+    match = _GRADE_RE.search(text or "")
+    return float(match.group(1).replace(",", ".")) if match else None
+
+
+class JsonlWriter:
+    """Escritura de líneas JSONL segura entre hilos y persistida en cada registro."""
+
+    def __init__(self, path: str, mode: str = "a"):
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        self._f = open(path, mode, encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, record: Dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+            os.fsync(self._f.fileno())
+
+    def close(self):
+        self._f.close()
+
+
+def grade_job(job: Dict, language: Optional[str], force_model: Optional[str]) -> Dict:
+    from openai_handler import grade_attachments
+
+    t0 = time.perf_counter()
+    record = {"id": job["id"], "path": job["path"]}
+    try:
+        attachments = load_attachments(job["path"])
+        errors = [att for att in attachments if att.get("kind") == "error"]
+        if errors:
+            raise RuntimeError(errors[0].get("summary") or "error procesando el fichero")
+        result = grade_attachments(attachments, job.get("question"), language, force_model)
+        record.update({
+            "status": "ok",
+            "model": result["model"],
+            "nota": extract_grade(result["content"]),
+            "evaluacion": result["content"],
+            "finish_reason": result["finish_reason"],
+            "usage": result["usage"],
+            "cached": result["cached"],
+        })
+    except Exception as e:
+        record.update({"status": "error", "error": str(e)})
+    record["elapsed_s"] = round(time.perf_counter() - t0, 3)
+    record["finished_at"] = datetime.now().isoformat(timespec="seconds")
+    return record
+
+
+def run_batch(jobs: List[Dict], output: str, workers: int, language: Optional[str], force_model: Optional[str]) -> Dict:
+    done = completed_ids(output)
+    pending = [job for job in jobs if job["id"] not in done]
+    print(f"{len(jobs)} entregas • {len(done)} ya evaluadas • {len(pending)} pendientes")
+    writer = JsonlWriter(output)
+    counts = {"ok": 0, "error": 0}
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch") as pool:
+            futures = {pool.submit(grade_job, job, language, force_model): job for job in pending}
+            for i, future in enumerate(as_completed(futures), start=1):
+                record = future.result()
+                writer.write(record)
+                counts[record["status"]] += 1
+                print(f"[{i}/{len(pending)}] {record['id']}: {record['status']} ({record['elapsed_s']}s)")
+    finally:
+        writer.close()
+    return counts
+
+
+def write_batch_api_file(jobs: List[Dict], path: str, workers: int, language: Optional[str], force_model: Optional[str]) -> int:
+    """
+    Genera el fichero de entrada de la Batch API (una petición por entrega).
+
+    Las entregas se procesan en paralelo; no se hace ninguna llamada al modelo.
+    El fichero se genera de nuevo en cada ejecución (la Batch API rechaza
+    `custom_id` repetidos) y solo sustituye al anterior al terminar.
+    """
+    from openai_handler import build_grading_request
+
+    def build(job: Dict) -> Optional[Dict]:
+        attachments = load_attachments(job["path"])
+        request = build_grading_request(attachments, job.get("question"), language, model=force_model)
+        return {"custom_id": job["id"], "method": "POST", "url": "/v1/chat/completions", "body": request}
+
+    tmp_path = f"{path}.tmp"
+    writer = JsonlWriter(tmp_path, mode="w")
+    written = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch") as pool:
+            futures = {pool.submit(build, job): job for job in jobs}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    writer.write(future.result())
+                    written += 1
+                except Exception as e:
+                    print(f"{job['id']}: error preparando la petición: {e}")
+        writer.close()
+        os.replace(tmp_path, path)
+    finally:
+        writer.close()
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return written
+
+
+def parse_args(argv: Iterable[str] = None):
+    parser = argparse.ArgumentParser(description="Evaluación por lotes de entregas (equivalente a /nota)")
+    source = parser.add_argument_group("entrada")
+    source.add_argument("--input", help="Directorio con las entregas (se recorre recursivamente)")
+    source.add_argument("--manifest", help="Manifiesto JSONL con id/path/question por línea")
+    parser.add_argument("--output", default="notas.jsonl", help="JSONL de resultados (se reanuda si existe)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--language", default=None, help="Idioma de salida (Català, Castellano, English)")
+    parser.add_argument("--model", default=None, help="Fuerza un modelo en lugar del router")
+    parser.add_argument("--batch-api-file", default=None, help="Genera entrada para la Batch API en lugar de llamar al modelo")
+    args = parser.parse_args(argv)
+    if not args.input and not args.manifest:
+        parser.error("indica --input o --manifest")
+    return args
+
+
+def main(argv: Iterable[str] = None) -> int:
+    args = parse_args(argv)
+    jobs = discover_jobs(args.input, args.manifest)
+    if args.batch_api_file:
+        written = write_batch_api_file(jobs, args.batch_api_file, args.workers, args.language, args.model)
+        print(f"{written} peticiones escritas en {args.batch_api_file}")
+        return 0
+    counts = run_batch(jobs, args.output, args.workers, args.language, args.model)
+    print(f"Terminado: {counts['ok']} correctas, {counts['error']} con error")
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
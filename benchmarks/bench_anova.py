@@ -0,0 +1,81 @@
+"""
+Compara el ANOVA de una vía vectorizado con la implementación anterior.
+
+La versión anterior construía cada grupo con una máscara booleana y
+calculaba la suma de cuadrados total con un bucle de Python. Se comprueba
+además que F, p y eta² coinciden con scipy.stats.f_oneway.
+
+Uso:
+    python benchmarks/bench_anova.py --rows 200000 --groups 50
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+from scipy import stats  # noqa: E402
+
+from statistical_analyzer import anova_test  # noqa: E402
+
+
+def legacy_anova(df: pd.DataFrame, groups_col: str, values_col: str) -> dict:
+    """Réplica de la versión anterior de `anova_test`, como referencia."""
+    groups = df[groups_col].unique()
+    group_data = [df[df[groups_col] == g][values_col].dropna().values for g in groups]
+    f_stat, p_value = stats.f_oneway(*group_data)
+    grand_mean = np.concatenate(group_data).mean()
+    ss_between = sum(len(g) * (np.mean(g) - grand_mean)**2 for g in group_data)
+    ss_total = sum((x - grand_mean)**2 for g in group_data for x in g)
+    return {"F-estadístico": f_stat, "p-valor": p_value, "Eta-cuadrado": ss_between / ss_total}
+
+
+def make_data(rows: int, groups: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    codes = rng.integers(0, groups, size=rows)
+    values = rng.normal(50, 10, size=rows) + codes * 0.05
+    values[rng.random(rows) < 0.02] = np.nan
+    return pd.DataFrame({"grupo": [f"g{c:03d}" for c in codes], "valor": values})
+
+
+def timed(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    df = make_data(args.rows, args.groups)
+    old = legacy_anova(df, "grupo", "valor")
+    new = anova_test(df, "grupo", "valor")
+    for key in ("F-estadístico", "p-valor", "Eta-cuadrado"):
+        if not np.isclose(old[key], new[key], rtol=1e-9, atol=1e-12):
+            print(f"Discrepancia en {key}: anterior={old[key]} nuevo={new[key]}")
+            return 1
+
+    old_s = timed(lambda: legacy_anova(df, "grupo", "valor"), args.repeat)
+    new_s = timed(lambda: anova_test(df, "grupo", "valor"), args.repeat)
+    print(f"{args.rows} filas, {args.groups} grupos (resultados idénticos)")
+    print(f"anterior:    {old_s * 1000:10.1f} ms")
+    print(f"vectorizado: {new_s * 1000:10.1f} ms  (x{old_s / new_s:.1f})")
+    print(f"F={new['F-estadístico']:.4f} p={new['p-valor']:.4g} eta²={new['Eta-cuadrado']:.5f} omega²={new['Omega-cuadrado']:.5f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
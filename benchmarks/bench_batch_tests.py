@@ -0,0 +1,76 @@
+"""
+Compara `batch_group_tests` con un bucle de `t_test_independent` por columna.
+
+Genera un cuestionario sintético (por defecto 200 ítems) con dos grupos,
+comprueba que t y p coinciden y mide ambas variantes.
+
+Uso:
+    python benchmarks/bench_batch_tests.py --rows 2000 --items 200
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from statistical_analyzer import adjust_pvalues, batch_group_tests, t_test_independent  # noqa: E402
+
+
+def make_data(rows: int, items: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({"grupo": rng.choice(["control", "tratamiento"], size=rows)})
+    effect = (df["grupo"] == "tratamiento").to_numpy() * 0.3
+    scores = rng.integers(1, 8, size=(rows, items)) + effect[:, None] * (rng.random(items) < 0.2)
+    scores[rng.random(scores.shape) < 0.03] = np.nan
+    return pd.concat([df, pd.DataFrame(scores, columns=[f"item_{i + 1:03d}" for i in range(items)])], axis=1)
+
+
+def timed(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    df = make_data(args.rows, args.items)
+    items = [c for c in df.columns if c.startswith("item_")]
+
+    def loop():
+        rows = [t_test_independent(df, "grupo", col) for col in items]
+        adjust_pvalues(np.array([r["p-valor"] for r in rows]), "holm")
+        return rows
+
+    looped = loop()
+    batch = batch_group_tests(df, "grupo", items)
+    expected = np.array([r["t-estadístico"] for r in looped])
+    if not np.allclose(expected, batch["estadístico"].to_numpy()):
+        print("Discrepancia entre el bucle y la versión por lotes")
+        return 1
+
+    loop_s = timed(loop, args.repeat)
+    batch_s = timed(lambda: batch_group_tests(df, "grupo", items), args.repeat)
+    print(f"{args.rows} filas × {args.items} ítems (resultados idénticos)")
+    print(f"bucle de t_test_independent: {loop_s * 1000:10.1f} ms")
+    print(f"batch_group_tests:           {batch_s * 1000:10.1f} ms  (x{loop_s / batch_s:.1f})")
+    print(f"Significativos tras Holm: {(batch['Significancia'] == 'Significativo').sum()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""
+Compara un análisis repetido leyendo el CSV cada vez frente al almacén columnar.
+
+Genera un CSV sintético tipo encuesta (por defecto 500 000 filas), lo
+convierte una vez a Feather y mide varias pruebas t seguidas con ambas
+fuentes de datos. Desde el almacén se dan dos tiempos: en frío (se vacía la
+caché de grupos antes de cada prueba, así que se leen las columnas del
+Feather mapeado) y en caliente (la prueba repetida reutiliza esa caché).
+
+Uso:
+    python benchmarks/bench_dataset_store.py --rows 500000 --repeat 5
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from dataset_store import store_dataset  # noqa: E402
+from file_processor import content_digest  # noqa: E402
+import statistical_analyzer  # noqa: E402
+from statistical_analyzer import t_test_independent  # noqa: E402
+
+
+def make_survey_csv(rows: int, items: int = 30, seed: int = 0) -> bytes:
+    rng = np.random.default_rng(seed)
+    data = {"grupo": rng.choice(["control", "tratamiento"], size=rows)}
+    for i in range(items):
+        data[f"item_{i + 1:02d}"] = rng.integers(1, 8, size=rows)
+    data["puntuacion"] = rng.normal(50, 10, size=rows).round(2)
+    return pd.DataFrame(data).to_csv(index=False).encode("utf-8")
+
+
+def timed(fn, repeat: int, setup=None) -> float:
+    """Mediana de `repeat` ejecuciones de `fn`; `setup` corre antes de cada una sin cronometrar."""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    raw = make_survey_csv(args.rows)
+    print(f"CSV: {len(raw) / 2**20:.1f} MB, {args.rows} filas\n")
+
+    buffer = io.BytesIO(raw)
+    key = content_digest(buffer)
+    t0 = time.perf_counter()
+    store_dataset(buffer, "encuesta.csv", key)
+    print(f"Conversión a Feather (una vez): {time.perf_counter() - t0:.3f} s")
+
+    csv_s = timed(lambda: t_test_independent(pd.read_csv(io.BytesIO(raw)), "grupo", "puntuacion"), args.repeat)
+    store_test = lambda: t_test_independent(key, "grupo", "puntuacion")  # noqa: E731
+    cold_s = timed(store_test, args.repeat, setup=statistical_analyzer._grouped_from_store.cache_clear)
+    store_test()
+    warm_s = timed(store_test, args.repeat)
+    print(f"Prueba t leyendo el CSV:        {csv_s * 1000:10.1f} ms")
+    print(f"Prueba t desde el almacén:      {cold_s * 1000:10.1f} ms  (en frío)")
+    print(f"Prueba t repetida (caché):      {warm_s * 1000:10.1f} ms  (en caliente)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
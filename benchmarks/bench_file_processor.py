@@ -0,0 +1,157 @@
+"""
+Compara la carga de PDFs en memoria frente a la versión anterior con fichero temporal.
+
+La versión anterior leía la subida, la escribía en un NamedTemporaryFile y
+pypdf la volvía a leer desde disco. Se mide tiempo, bytes escritos a disco y
+pico de memoria (tracemalloc) de ambas variantes sobre un PDF sintético o uno
+real pasado con --pdf.
+
+También compara la extracción por páginas secuencial, en paralelo (pool de
+procesos) y con parada temprana al llenar la vista previa.
+
+Uso:
+    python benchmarks/bench_file_processor.py --pages 300
+    python benchmarks/bench_file_processor.py --pdf tesis.pdf --repeat 5
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import PDF_WORKERS  # noqa: E402
+from file_processor import PREVIEW_CHAR_LIMIT, extract_pdf_pages, process_pdf  # noqa: E402
+
+
+def make_pdf(pages: int, lines_per_page: int = 40) -> bytes:
+    """PDF mínimo con texto extraíble (Helvetica), sin dependencias."""
+    objects: List[bytes] = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"",  # /Pages, se rellena al final
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for p in range(pages):
+        lines = [
+            f"({'Pagina %d linea %d: los resultados sugieren una relacion moderada entre variables.' % (p + 1, i + 1)}) Tj 0 -16 Td"
+            for i in range(lines_per_page)
+        ]
+        stream = ("BT /F1 10 Tf 40 780 Td " + " ".join(lines) + " ET").encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), pages
+    )
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % i + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for off in offsets:
+        out.write(b"%010d 00000 n \n" % off)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def legacy_process_pdf(pdf_file) -> str:
+    """Réplica de la versión con NamedTemporaryFile, como referencia."""
+    from pypdf import PdfReader
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+        tmp.write(pdf_file.read())
+        tmp_path = tmp.name
+    try:
+        reader = PdfReader(tmp_path)
+        return "\n".join(page.extract_text() or "" for page in reader.pages)
+    finally:
+        os.unlink(tmp_path)
+
+
+class CountingUpload(io.BytesIO):
+    """Subida simulada que cuenta los bytes leídos con read()."""
+
+    name = "bench.pdf"
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def measure(fn: Callable, data: bytes, repeat: int) -> Dict:
+    times, peaks, reads = [], [], []
+    for _ in range(repeat):
+        upload = CountingUpload(data)
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        fn(upload)
+        times.append(time.perf_counter() - t0)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        reads.append(upload.bytes_read)
+    return {
+        "time_s": statistics.median(times),
+        "peak_mb": statistics.median(peaks) / 2**20,
+        "read_mb": statistics.median(reads) / 2**20,
+    }
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pdf", help="PDF real a medir (por defecto uno sintético)")
+    parser.add_argument("--pages", type=int, default=300, help="Páginas del PDF sintético")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.pdf:
+        with open(args.pdf, "rb") as f:
+            data = f.read()
+    else:
+        data = make_pdf(args.pages)
+    size_mb = len(data) / 2**20
+    print(f"PDF: {size_mb:.1f} MB\n")
+
+    results = {
+        "temporal (anterior)": measure(legacy_process_pdf, data, args.repeat),
+        "en memoria": measure(process_pdf, data, args.repeat),
+    }
+    print(f"{'variante':<22}{'tiempo (s)':>12}{'pico (MB)':>12}{'leído (MB)':>12}{'disco (MB)':>12}")
+    for name, r in results.items():
+        disk = size_mb if name.startswith("temporal") else 0.0
+        print(f"{name:<22}{r['time_s']:>12.3f}{r['peak_mb']:>12.1f}{r['read_mb']:>12.1f}{disk:>12.1f}")
+
+    variants = {
+        "secuencial": dict(workers=1),
+        f"paralelo ({PDF_WORKERS} proc.)": dict(workers=PDF_WORKERS, parallel_min_pages=1),
+        "vista previa": dict(workers=PDF_WORKERS, max_chars=PREVIEW_CHAR_LIMIT + 1),
+    }
+    print(f"\n{'extracción':<22}{'tiempo (s)':>12}{'páginas':>12}")
+    for name, kwargs in variants.items():
+        times = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            pages, stats = extract_pdf_pages(io.BytesIO(data), **kwargs)
+            times.append(time.perf_counter() - t0)
+        print(f"{name:<22}{statistics.median(times):>12.3f}{stats['extracted']:>8}/{stats['pages']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
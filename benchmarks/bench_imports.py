@@ -0,0 +1,102 @@
+"""
+Mide el tiempo de importación de los módulos de la app con `python -X importtime`.
+
+Cada módulo se importa en un proceso nuevo, así que la cifra es la de un
+arranque en frío. Con --budget-ms el script falla (código 1) si algún módulo
+supera el presupuesto, para detectar regresiones del arranque.
+
+Uso:
+    python benchmarks/bench_imports.py
+    python benchmarks/bench_imports.py --budget-ms 150 --repeat 5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Optional
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "config",
+    "token_counter",
+    "rate_limiter",
+    "cache_store",
+    "dataset_store",
+    "data_profiler",
+    "openai_handler",
+    "file_processor",
+    "statistical_analyzer",
+]
+
+
+def import_time_us(module: str) -> Optional[Dict[str, int]]:
+    """
+    Importa `module` en un subproceso y devuelve el tiempo acumulado (µs) del
+    módulo y de sus importaciones directas, según -X importtime.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    if proc.returncode != 0:
+        print(f"  {module}: error al importar\n{proc.stderr.splitlines()[-1] if proc.stderr else ''}")
+        return None
+    # Las importaciones hijas se listan (con sangría) antes que su padre; las
+    # de nivel 0 previas al módulo son el arranque del intérprete y se ignoran.
+    children: Dict[str, int] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2][1:]
+        level = (len(name) - len(name.lstrip())) // 2
+        if level == 0:
+            if name.strip() == module:
+                return {**children, module: int(parts[1])}
+            children = {}
+        elif level == 1:
+            children[name.strip()] = int(parts[1])
+    return None
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones por módulo (se usa la mediana)")
+    parser.add_argument("--budget-ms", type=float, default=None, help="Máximo permitido por módulo")
+    parser.add_argument("--top", type=int, default=5, help="Dependencias más lentas a mostrar")
+    args = parser.parse_args(argv)
+
+    over_budget = []
+    print(f"{'módulo':<24}{'mediana (ms)':>14}   dependencias más lentas")
+    for module in args.modules:
+        runs = [import_time_us(module) for _ in range(args.repeat)]
+        runs = [r for r in runs if r]
+        if not runs:
+            over_budget.append(module)
+            continue
+        total_ms = statistics.median(r.get(module, 0) for r in runs) / 1000
+        last = runs[-1]
+        deps = sorted(((t, n) for n, t in last.items() if n != module), reverse=True)[: args.top]
+        deps_txt = ", ".join(f"{n} {t / 1000:.0f}" for t, n in deps)
+        print(f"{module:<24}{total_ms:>14.1f}   {deps_txt}")
+        if args.budget_ms is not None and total_ms > args.budget_ms:
+            over_budget.append(module)
+
+    if over_budget:
+        print(f"\nFuera de presupuesto: {', '.join(over_budget)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
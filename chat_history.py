@@ -0,0 +1,125 @@
+"""
+Compactación del historial de chat dentro de un presupuesto de tokens por modelo.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from config import (
+    DEFAULT_MODEL,
+    HISTORY_TOKEN_BUDGETS,
+    HISTORY_SUMMARY_MAX_TOKENS,
+    HISTORY_MIN_RECENT_MESSAGES,
+    HISTORY_FOLD_WATERMARK,
+)
+from token_counter import count_message_tokens, count_tokens, truncate_text_to_tokens
+
+
+SUMMARY_HEADER = "RESUMEN DE LA CONVERSACIÓN ANTERIOR (turnos antiguos plegados):"
+
+
+def new_history_state() -> Dict:
+    """Estado del resumen acumulado; se guarda en st.session_state."""
+    return {"summary": "", "folded": 0}
+
+
+def history_budget(model: Optional[str] = None) -> int:
+    return HISTORY_TOKEN_BUDGETS.get(model or DEFAULT_MODEL, HISTORY_TOKEN_BUDGETS[DEFAULT_MODEL])
+
+
+def _window_start(history: List[Dict], model: Optional[str], max_tokens: int) -> int:
+    """Índice desde el que los últimos mensajes caben en `max_tokens` (con el mínimo literal)."""
+    start = len(history)
+    used = 0
+    for idx in range(len(history) - 1, -1, -1):
+        tokens = count_message_tokens([history[idx]], model)
+        kept = len(history) - idx
+        if used + tokens > max_tokens and kept > HISTORY_MIN_RECENT_MESSAGES:
+            break
+        used += tokens
+        start = idx
+    return start
+
+
+def compact_history(
+    history: List[Dict],
+    model: Optional[str] = None,
+    state: Optional[Dict] = None,
+    budget_tokens: Optional[int] = None,
+) -> Tuple[List[Dict], Dict]:
+    """
+    Ajusta el historial al presupuesto de tokens del modelo.
+
+    Los turnos más recientes se envían literales; los que no caben se pliegan
+    en un resumen acumulado guardado en `state`. El resumen solo se recalcula
+    cuando los turnos sin plegar superan el presupuesto, y entonces se pliega
+    hasta dejarlos en `HISTORY_FOLD_WATERMARK` del mismo: así hacen falta
+    varios turnos antes del siguiente resumen. El punto de corte nunca
+    retrocede, así que el prefijo enviado es estable entre turnos. Si falla
+    el resumen (error de la API, 429...), `state` no cambia y solo se envían
+    los turnos recientes que caben en el presupuesto.
+
+    Args:
+        history: Historial completo (mensajes {"role", "content"})
+        model: Modelo destino (define presupuesto y codificación)
+        state: Estado devuelto por `new_history_state`; se actualiza in situ
+        budget_tokens: Presupuesto explícito (por defecto HISTORY_TOKEN_BUDGETS)
+
+    Returns:
+        (mensajes a enviar, estadísticas con full_tokens, sent_tokens,
+        saved_tokens, folded_messages, summary_recomputed y summary_failed)
+    """
+    state = state if state is not None else new_history_state()
+    if state["folded"] > len(history):
+        # El historial se reinició (/limpiar, "Reiniciar chat")
+        state.update(new_history_state())
+
+    budget = budget_tokens or history_budget(model)
+    recent_budget = max(0, budget - HISTORY_SUMMARY_MAX_TOKENS)
+
+    # Histéresis: solo se pliega si lo no plegado ya no cabe, y entonces hasta la marca baja
+    if _window_start(history, model, recent_budget) <= state["folded"]:
+        cut = state["folded"]
+    else:
+        cut = max(_window_start(history, model, int(recent_budget * HISTORY_FOLD_WATERMARK)), state["folded"])
+
+    recomputed = False
+    failed = False
+    start = state["folded"]
+    if cut > state["folded"]:
+        from openai_handler import summarize_conversation
+
+        try:
+            summary = summarize_conversation(state["summary"], history[state["folded"]:cut])
+        except Exception:
+            # Sin resumen nuevo: los turnos que no caben se omiten en este envío
+            failed = True
+            start = cut
+        else:
+            state["summary"] = summary
+            state["folded"] = start = cut
+            recomputed = True
+
+    recent = list(history[start:])
+    if failed:
+        while len(recent) > 1 and count_message_tokens(recent, model) > recent_budget:
+            recent.pop(0)
+        if recent and isinstance(recent[0].get("content"), str) and count_message_tokens(recent, model) > recent_budget:
+            recent[0] = {**recent[0], "content": truncate_text_to_tokens(recent[0]["content"], recent_budget, model)}
+
+    messages: List[Dict] = []
+    if state["summary"]:
+        messages.append({"role": "system", "content": f"{SUMMARY_HEADER}\n{state['summary']}"})
+    messages.extend(recent)
+
+    full_tokens = count_message_tokens(history, model)
+    sent_tokens = count_message_tokens(messages, model)
+    stats = {
+        "full_tokens": full_tokens,
+        "sent_tokens": sent_tokens,
+        "saved_tokens": max(0, full_tokens - sent_tokens),
+        "folded_messages": state["folded"],
+        "summary_tokens": count_tokens(state["summary"], model),
+        "summary_recomputed": recomputed,
+        "summary_failed": failed,
+    }
+    return messages, stats
@@ -10,26 +10,51 @@ load_dotenv()
 
 # Configuración de OpenAI
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# URL base alternativa (servidor compatible o mock_openai_server.py); vacío = API oficial
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
 
 # Modelos disponibles
+# quality: nivel relativo de calidad; cost_rank: 1 = más barato (usados por model_router)
 AVAILABLE_MODELS = {
     "gpt-4-turbo": {
         "name": "GPT-4 Turbo",
         "use_case": "análisis complejo, precisión máxima",
         "cost": "medio",
-        "speed": "rápido"
+        "speed": "rápido",
+        "quality": 4,
+        "cost_rank": 4,
+        "context_window": 128000,
+        "vision": True,
     },
     "gpt-4o": {
         "name": "GPT-4o (omni)",
         "use_case": "equilibrio calidad/velocidad, visión",
         "cost": "medio",
-        "speed": "muy rápido"
+        "speed": "muy rápido",
+        "quality": 3,
+        "cost_rank": 3,
+        "context_window": 128000,
+        "vision": True,
+    },
+    "gpt-4o-mini": {
+        "name": "GPT-4o mini",
+        "use_case": "fases auxiliares, resúmenes, respaldo rápido",
+        "cost": "muy bajo",
+        "speed": "ultra rápido",
+        "quality": 2,
+        "cost_rank": 1,
+        "context_window": 128000,
+        "vision": True,
     },
     "gpt-3.5-turbo": {
         "name": "GPT-3.5 Turbo",
         "use_case": "tareas simples, máxima velocidad",
         "cost": "bajo",
-        "speed": "ultra rápido"
+        "speed": "ultra rápido",
+        "quality": 1,
+        "cost_rank": 2,
+        "context_window": 16385,
+        "vision": False,
     }
 }
 
@@ -44,6 +69,17 @@ MODEL_SELECTION_RULES = {
     "simple": "gpt-3.5-turbo",      # Preguntas simples: máxima velocidad
 }
 
+# Latencia objetivo (p95, segundos) por contexto para el router de modelos
+LATENCY_TARGETS_S = {
+    "chat": float(os.getenv("SANAL_LATENCY_TARGET_CHAT", "20")),
+    "simple": float(os.getenv("SANAL_LATENCY_TARGET_SIMPLE", "10")),
+    "vision": float(os.getenv("SANAL_LATENCY_TARGET_VISION", "30")),
+    "analysis": float(os.getenv("SANAL_LATENCY_TARGET_ANALYSIS", "60")),
+    "generation": float(os.getenv("SANAL_LATENCY_TARGET_GENERATION", "90")),
+}
+ROUTER_WINDOW = int(os.getenv("SANAL_ROUTER_WINDOW", "50"))  # llamadas recordadas por modelo
+ROUTER_MIN_SAMPLES = int(os.getenv("SANAL_ROUTER_MIN_SAMPLES", "5"))
+
 # Configuración de Streamlit
 STREAMLIT_CONFIG = {
     "theme.primaryColor": "#c41e3a",  # Rojo del Dr. Sanal
@@ -57,6 +93,81 @@ MAX_TOKENS_CHAT = 2000
 MAX_TOKENS_ANALYSIS = 2500
 MAX_TOKENS_GENERATION = 4000
 
+# Tamaño de la caché LRU de conteos de tokens (entradas)
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("SANAL_TOKEN_CACHE_SIZE", "4096"))
+
+# Reintentos ante 429/5xx/errores de red (backoff exponencial con jitter)
+API_MAX_RETRIES = int(os.getenv("SANAL_API_MAX_RETRIES", "5"))
+API_BACKOFF_BASE_S = float(os.getenv("SANAL_API_BACKOFF_BASE_S", "1.0"))
+API_BACKOFF_MAX_S = float(os.getenv("SANAL_API_BACKOFF_MAX_S", "30"))
+
+# Secciones de la Fase 2 que se redactan en paralelo (1 = secuencial)
+PHASE2_CONCURRENCY = int(os.getenv("SANAL_PHASE2_CONCURRENCY", "5"))
+
+# Continuaciones de secciones cortadas por longitud (Fase 2)
+MAX_SECTION_CONTINUATIONS = int(os.getenv("SANAL_MAX_CONTINUATIONS", "3"))
+CONTINUATION_TAIL_TOKENS = int(os.getenv("SANAL_CONTINUATION_TAIL_TOKENS", "800"))
+CONTINUATION_CONTEXT_TOKENS = int(os.getenv("SANAL_CONTINUATION_CONTEXT_TOKENS", "600"))
+
+# Caché persistente de respuestas (opcional, desactivada por defecto)
+RESPONSE_CACHE_ENABLED = os.getenv("SANAL_RESPONSE_CACHE", "0") == "1"
+CACHE_DB_PATH = os.getenv("SANAL_CACHE_PATH", os.path.join(".cache", "sanal_cache.sqlite3"))
+RESPONSE_CACHE_TTL_S = float(os.getenv("SANAL_RESPONSE_CACHE_TTL", "86400"))  # 0 = sin caducidad
+RESPONSE_CACHE_MAX_MB = float(os.getenv("SANAL_RESPONSE_CACHE_MAX_MB", "200"))
+
+# Adjuntos como prefijo estable de la conversación (aprovecha la caché de prompts)
+# en lugar de repetirlos en cada mensaje del estudiante
+ATTACHMENT_PREFIX_MODE = os.getenv("SANAL_ATTACHMENT_PREFIX", "1") == "1"
+
+# Presupuesto de tokens del historial de chat por modelo (turnos recientes + resumen)
+HISTORY_TOKEN_BUDGETS = {
+    "gpt-4-turbo": 6000,
+    "gpt-4o": 6000,
+    "gpt-4o-mini": 4000,
+    "gpt-3.5-turbo": 3000,
+}
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("SANAL_HISTORY_SUMMARY_MAX_TOKENS", "500"))
+HISTORY_MIN_RECENT_MESSAGES = 2  # el último intercambio siempre va literal
+# Al plegar, los turnos recientes se recortan hasta esta fracción de su presupuesto,
+# así el resumen no se recalcula en cada turno
+HISTORY_FOLD_WATERMARK = float(os.getenv("SANAL_HISTORY_FOLD_WATERMARK", "0.6"))
+
+# Extracción de PDFs: a partir de este número de páginas se reparten entre procesos
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("SANAL_PDF_PARALLEL_MIN_PAGES", "40"))
+PDF_WORKERS = int(os.getenv("SANAL_PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGE_TIMEOUT_S = float(os.getenv("SANAL_PDF_PAGE_TIMEOUT_S", "20"))
+
+# Caché de adjuntos procesados por hash de contenido (compartida entre sesiones)
+ATTACHMENT_CACHE_ENABLED = os.getenv("SANAL_ATTACHMENT_CACHE", "1") == "1"
+ATTACHMENT_CACHE_MAX_MB = float(os.getenv("SANAL_ATTACHMENT_CACHE_MAX_MB", "100"))
+
+# Archivos que se procesan a la vez al añadir adjuntos
+INGEST_WORKERS = int(os.getenv("SANAL_INGEST_WORKERS", "4"))
+# Procesos para los parsers que no sueltan el GIL (PDF, DOCX, CSV/XLSX); 0 = todo en hilos
+INGEST_PROCESSES = int(os.getenv("SANAL_INGEST_PROCESSES", str(min(4, os.cpu_count() or 1))))
+INGEST_FILE_TIMEOUT_S = float(os.getenv("SANAL_INGEST_FILE_TIMEOUT_S", "120"))  # incluye la espera en cola
+
+# Preprocesado de imágenes para visión: más allá de 2048 px (lado corto 768 px)
+# el proveedor reescala igualmente, así que no tiene sentido enviar más
+IMAGE_MAX_SIDE_PX = int(os.getenv("SANAL_IMAGE_MAX_SIDE_PX", "2048"))
+IMAGE_SHORT_SIDE_PX = int(os.getenv("SANAL_IMAGE_SHORT_SIDE_PX", "768"))
+IMAGE_JPEG_QUALITY = int(os.getenv("SANAL_IMAGE_JPEG_QUALITY", "85"))
+IMAGE_DETAIL = os.getenv("SANAL_IMAGE_DETAIL", "auto")  # auto | low | high
+IMAGE_LOW_DETAIL_MAX_PX = 512  # imágenes que caben en una tesela: "low" no pierde nada
+
+# Ingesta de datos tabulares: esquema inferido de una muestra y lectura por bloques
+DATA_SAMPLE_ROWS = int(os.getenv("SANAL_DATA_SAMPLE_ROWS", "1000"))
+DATA_CHUNK_ROWS = int(os.getenv("SANAL_DATA_CHUNK_ROWS", "100000"))
+
+# Almacén columnar (Feather) de los datasets subidos, reutilizado entre análisis
+DATASET_STORE_DIR = os.getenv("SANAL_DATASET_DIR", os.path.join(".cache", "datasets"))
+DATASET_STORE_MAX_MB = float(os.getenv("SANAL_DATASET_STORE_MAX_MB", "2000"))
+
+# Perfil de los datasets para el contexto del modelo
+PROFILE_SAMPLE_ROWS = int(os.getenv("SANAL_PROFILE_SAMPLE_ROWS", "5000"))  # cuantiles y correlación
+PROFILE_CORRELATION_TOP_K = int(os.getenv("SANAL_PROFILE_CORRELATION_TOP_K", "10"))  # 0 = sin correlación
+DATA_PROFILE_MAX_TOKENS = int(os.getenv("SANAL_DATA_PROFILE_MAX_TOKENS", "800"))
+
 # Temperatura por defecto
 DEFAULT_TEMPERATURE = 0.7
 
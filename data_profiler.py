@@ -0,0 +1,262 @@
+"""
+Perfil de datasets en una sola pasada por bloques de filas.
+
+Para cada bloque se actualizan de forma vectorizada, en todas las columnas
+numéricas a la vez, los recuentos, valores perdidos, sumas de potencias
+(momentos), mínimos y máximos. Los cuantiles y la correlación se calculan
+sobre una muestra uniforme de filas (muestreo bottom-k) que se mantiene
+durante la misma pasada, así que nunca se materializa el dataset completo.
+"""
+
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from config import PROFILE_SAMPLE_ROWS, PROFILE_CORRELATION_TOP_K, DATA_PROFILE_MAX_TOKENS
+from token_counter import count_tokens
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+QUANTILES = (0.25, 0.5, 0.75)
+TOP_VALUES = 3  # valores más frecuentes por columna no numérica
+MAX_TRACKED_VALUES = 1000  # distintos que se siguen por columna no numérica
+
+
+class ProfileAccumulator:
+    """Estado de la pasada: se alimenta bloque a bloque con `update`."""
+
+    def __init__(self, sample_rows: int, seed: int = 0):
+        self.sample_rows = sample_rows
+        self.rng = np.random.default_rng(seed)
+        self.rows = 0
+        self.columns: List[str] = []
+        self.dtypes: Dict[str, str] = {}
+        self.numeric: List[str] = []
+        self.shift: Optional[np.ndarray] = None
+        self.count = self.power_sums = self.minimum = self.maximum = None
+        self.sample: Optional[np.ndarray] = None
+        self.sample_keys: Optional[np.ndarray] = None
+        self.other_missing: Dict[str, int] = {}
+        self.other_values: Dict[str, Counter] = {}
+        self.other_saturated: Dict[str, bool] = {}
+
+    def _init(self, chunk: "pd.DataFrame"):
+        self.columns = [str(c) for c in chunk.columns]
+        self.dtypes = {str(c): str(t) for c, t in chunk.dtypes.items()}
+        self.numeric = [str(c) for c in chunk.select_dtypes(include=["number", "bool"]).columns]
+        p = len(self.numeric)
+        self.count = np.zeros(p)
+        self.power_sums = np.zeros((4, p))
+        self.minimum = np.full(p, np.inf)
+        self.maximum = np.full(p, -np.inf)
+        self.sample = np.empty((0, p))
+        self.sample_keys = np.empty(0)
+        for col in self.columns:
+            if col not in self.numeric:
+                self.other_missing[col] = 0
+                self.other_values[col] = Counter()
+                self.other_saturated[col] = False
+
+    def update(self, chunk: "pd.DataFrame"):
+        if not self.columns:
+            self._init(chunk)
+        if not all(isinstance(c, str) for c in chunk.columns):
+            chunk = chunk.rename(columns=str)
+        self.rows += len(chunk)
+        if len(chunk) == 0:
+            return
+
+        if self.numeric:
+            x = chunk[self.numeric].to_numpy(dtype=float, na_value=np.nan)
+            valid = ~np.isnan(x)
+            if self.shift is None:
+                # Desplazamiento = media del primer bloque: evita la cancelación en las sumas de potencias
+                counts = valid.sum(axis=0)
+                self.shift = np.where(counts > 0, np.nansum(x, axis=0) / np.maximum(counts, 1), 0.0)
+            centered = np.where(valid, x - self.shift, 0.0)
+            self.count += valid.sum(axis=0)
+            power = centered.copy()
+            for k in range(4):
+                self.power_sums[k] += power.sum(axis=0)
+                if k < 3:
+                    power *= centered
+            self.minimum = np.minimum(self.minimum, np.where(valid, x, np.inf).min(axis=0))
+            self.maximum = np.maximum(self.maximum, np.where(valid, x, -np.inf).max(axis=0))
+
+            # Muestra uniforme de filas: se conservan las de menor clave aleatoria
+            keys = self.rng.random(len(x))
+            all_keys = np.concatenate([self.sample_keys, keys])
+            all_rows = np.vstack([self.sample, x])
+            if len(all_keys) > self.sample_rows:
+                keep = np.argpartition(all_keys, self.sample_rows)[: self.sample_rows]
+                all_keys, all_rows = all_keys[keep], all_rows[keep]
+            self.sample_keys, self.sample = all_keys, all_rows
+
+        for col in self.other_values:
+            series = chunk[col]
+            self.other_missing[col] += int(series.isna().sum())
+            counts = self.other_values[col]
+            counts.update(series.dropna().astype(str).value_counts().to_dict())
+            if len(counts) > MAX_TRACKED_VALUES:
+                self.other_values[col] = Counter(dict(counts.most_common(MAX_TRACKED_VALUES)))
+                self.other_saturated[col] = True
+
+    def _moments(self, i: int) -> Dict:
+        n = self.count[i]
+        if n == 0:
+            return {"n": 0}
+        s1, s2, s3, s4 = (self.power_sums[k][i] / n for k in range(4))
+        mean_c = s1
+        m2 = s2 - mean_c ** 2
+        m3 = s3 - 3 * mean_c * s2 + 2 * mean_c ** 3
+        m4 = s4 - 4 * mean_c * s3 + 6 * mean_c ** 2 * s2 - 3 * mean_c ** 4
+        variance = m2 * n / (n - 1) if n > 1 else 0.0
+        return {
+            "n": int(n),
+            "mean": float(self.shift[i] + mean_c),
+            "std": float(np.sqrt(max(variance, 0.0))),
+            "skew": float(m3 / m2 ** 1.5) if m2 > 0 else 0.0,
+            "kurtosis": float(m4 / m2 ** 2 - 3) if m2 > 0 else 0.0,
+            "min": float(self.minimum[i]),
+            "max": float(self.maximum[i]),
+        }
+
+    def finish(self, correlation_top_k: int) -> Dict:
+        columns: Dict[str, Dict] = {}
+        quantiles = None
+        if self.numeric:
+            with np.errstate(all="ignore"):
+                quantiles = np.nanquantile(self.sample, QUANTILES, axis=0) if len(self.sample) else None
+        for i, col in enumerate(self.numeric):
+            info = {"dtype": self.dtypes[col], "missing": int(self.rows - self.count[i]), **self._moments(i)}
+            if quantiles is not None and self.count[i] > 0:
+                info["quantiles"] = {f"p{int(q * 100)}": float(quantiles[j][i]) for j, q in enumerate(QUANTILES)}
+            columns[col] = info
+        for col, counts in self.other_values.items():
+            columns[col] = {
+                "dtype": self.dtypes[col],
+                "n": self.rows - self.other_missing[col],
+                "missing": self.other_missing[col],
+                "unique": len(counts),
+                "unique_is_lower_bound": self.other_saturated[col],
+                "top": counts.most_common(TOP_VALUES),
+            }
+
+        profile = {
+            "rows": self.rows,
+            "columns": list(self.columns),
+            "column_stats": {c: columns[c] for c in self.columns if c in columns},
+            "sample_rows": int(len(self.sample)) if self.sample is not None else 0,
+        }
+        if correlation_top_k and len(self.numeric) > 1 and len(self.sample) > 2:
+            profile["correlation"] = self._correlation(correlation_top_k)
+        return profile
+
+    def _correlation(self, top_k: int) -> Dict:
+        import pandas as pd
+
+        # Las k columnas con más datos válidos (y con varianza)
+        candidates = [i for i in range(len(self.numeric)) if self.maximum[i] > self.minimum[i]]
+        chosen = sorted(candidates, key=lambda i: (-self.count[i], i))[:top_k]
+        names = [self.numeric[i] for i in chosen]
+        corr = pd.DataFrame(self.sample[:, chosen], columns=names).corr().to_numpy()
+        rows, cols = np.triu_indices(len(names), k=1)
+        pairs = sorted(
+            ((names[a], names[b], float(corr[a, b])) for a, b in zip(rows, cols) if not np.isnan(corr[a, b])),
+            key=lambda item: -abs(item[2]),
+        )
+        return {"columns": names, "top_pairs": pairs[:top_k]}
+
+
+def profile_chunks(
+    chunks: Iterable["pd.DataFrame"],
+    correlation_top_k: int = PROFILE_CORRELATION_TOP_K,
+    sample_rows: int = PROFILE_SAMPLE_ROWS,
+) -> Dict:
+    """
+    Perfil de un dataset que llega por bloques de filas (mismas columnas en todos).
+
+    Args:
+        chunks: Bloques del dataset (p. ej. `pd.read_csv(..., chunksize=...)`)
+        correlation_top_k: Columnas numéricas incluidas en la correlación (0 = sin correlación)
+        sample_rows: Filas de la muestra para cuantiles y correlación
+
+    Returns:
+        Dict con rows, columns, column_stats, sample_rows y, si procede, correlation
+    """
+    acc = ProfileAccumulator(sample_rows)
+    for chunk in chunks:
+        acc.update(chunk)
+    return acc.finish(correlation_top_k)
+
+
+def profile_dataframe(
+    df: "pd.DataFrame",
+    correlation_top_k: int = PROFILE_CORRELATION_TOP_K,
+    chunk_rows: int = 100_000,
+) -> Dict:
+    """Perfil de un DataFrame en memoria (recorrido por bloques de `chunk_rows` filas)."""
+    chunks = (df.iloc[start:start + chunk_rows] for start in range(0, max(len(df), 1), chunk_rows))
+    return profile_chunks(chunks, correlation_top_k)
+
+
+def _fmt(value: float) -> str:
+    return f"{value:.4g}"
+
+
+def _column_line(name: str, info: Dict, rows: int) -> str:
+    missing_pct = 100 * info["missing"] / rows if rows else 0
+    head = f"- {name} ({info['dtype']}): n={info['n']}, perdidos={missing_pct:.1f}%"
+    if "mean" in info:
+        q = info.get("quantiles", {})
+        quart = f", P25/50/75={_fmt(q['p25'])}/{_fmt(q['p50'])}/{_fmt(q['p75'])}" if q else ""
+        return (
+            f"{head}, M={_fmt(info['mean'])}, DE={_fmt(info['std'])}, "
+            f"mín={_fmt(info['min'])}{quart}, máx={_fmt(info['max'])}, "
+            f"asimetría={info['skew']:.2f}, curtosis={info['kurtosis']:.2f}"
+        )
+    if "unique" in info:
+        unique = f"≥{info['unique']}" if info["unique_is_lower_bound"] else str(info["unique"])
+        top = ", ".join(f"{v} ({c})" for v, c in info["top"])
+        return f"{head}, distintos={unique}, más frecuentes: {top}"
+    return head
+
+
+def format_profile(profile: Dict, max_tokens: int = DATA_PROFILE_MAX_TOKENS, model: Optional[str] = None) -> str:
+    """
+    Texto compacto del perfil para el contexto del modelo, dentro de `max_tokens`.
+
+    Si no cabe, se omiten primero las correlaciones y después las últimas
+    columnas (indicando cuántas faltan).
+    """
+    rows = profile["rows"]
+    header = f"PERFIL DEL DATASET: {rows} filas × {len(profile['columns'])} columnas"
+    lines = [_column_line(name, info, rows) for name, info in profile["column_stats"].items()]
+    corr_lines = []
+    if profile.get("correlation", {}).get("top_pairs"):
+        corr_lines.append(f"Correlaciones más fuertes (muestra de {profile['sample_rows']} filas):")
+        corr_lines += [f"- {a} ~ {b}: r={r:.2f}" for a, b, r in profile["correlation"]["top_pairs"]]
+
+    def render(n_columns: int, with_corr: bool) -> str:
+        parts = [header, *lines[:n_columns]]
+        if n_columns < len(lines):
+            parts.append(f"... y {len(lines) - n_columns} columnas más")
+        if with_corr:
+            parts += corr_lines
+        return "\n".join(parts)
+
+    text = render(len(lines), bool(corr_lines))
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    # Búsqueda binaria del número de columnas que caben sin correlaciones
+    lo, hi = 0, len(lines)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(render(mid, False), model) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return render(lo, False)
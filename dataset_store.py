@@ -0,0 +1,356 @@
+"""
+Almacén columnar de datasets subidos (Arrow/Feather) indexado por hash de contenido.
+
+Cada CSV/XLSX se convierte una sola vez a un fichero Feather sin comprimir;
+los análisis lo abren con memory-map y leen solo las columnas que necesitan.
+"""
+
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+from config import (
+    DATASET_STORE_DIR,
+    DATASET_STORE_MAX_MB,
+    DATA_CHUNK_ROWS,
+    PROFILE_SAMPLE_ROWS,
+    PROFILE_CORRELATION_TOP_K,
+)
+
+# pyarrow y pandas se importan al convertir o abrir un dataset
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+_OPEN_TABLES_MAX = 8
+
+_open_tables: "OrderedDict[str, object]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def dataset_path(key: str) -> str:
+    return os.path.join(DATASET_STORE_DIR, f"{key}.feather")
+
+
+def has_dataset(key: str) -> bool:
+    return os.path.exists(dataset_path(key))
+
+
+def _frame_to_table(df: "pd.DataFrame"):
+    import pyarrow as pa
+
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Columnas object con tipos mezclados: se guardan como texto
+        mixed = df.select_dtypes(include=["object"]).columns
+        table = pa.Table.from_pandas(df.astype({c: str for c in mixed}), preserve_index=False)
+    return table.replace_schema_metadata(None)
+
+
+def _widen_type(current, incoming):
+    """Tipo común de una columna cuando dos bloques no coinciden."""
+    import pyarrow as pa
+
+    if pa.types.is_null(current):
+        return incoming
+    if pa.types.is_null(incoming):
+        return current
+    numeric = (pa.types.is_integer, pa.types.is_floating)
+    if any(f(current) for f in numeric) and any(f(incoming) for f in numeric):
+        return pa.float64()
+    return pa.string()
+
+
+class _FeatherSink:
+    """
+    Escribe bloques de filas en un Feather sin comprimir a medida que llegan.
+
+    El esquema lo fija el primer bloque. Si uno posterior trae un tipo
+    incompatible (enteros que pasan a decimales, números que pasan a texto),
+    el esquema se amplía y lo ya escrito se reescribe desde el propio fichero
+    temporal, sin volver a leer el original. Con `profile`, cada bloque ya
+    con sus tipos finales alimenta el perfil de `data_profiler`.
+    """
+
+    def __init__(self, path: str, profile: bool = False):
+        self.path = path
+        self.profile = profile
+        self.schema = None
+        self._file = None
+        self._writer = None
+        self._acc = None
+
+    def _open(self, schema):
+        import pyarrow as pa
+
+        self.schema = schema
+        self._file = pa.OSFile(self.path, "wb")
+        # Sin compresión: requisito para leer con memory-map sin copiar
+        self._writer = pa.ipc.new_file(self._file, schema)
+        if self.profile:
+            from data_profiler import ProfileAccumulator
+
+            self._acc = ProfileAccumulator(PROFILE_SAMPLE_ROWS)
+
+    def _append(self, table):
+        self._writer.write_table(table)
+        if self._acc is not None:
+            self._acc.update(table.to_pandas())
+
+    def write(self, table):
+        import pyarrow as pa
+
+        table = table.replace_schema_metadata(None)
+        if self.schema is None:
+            self._open(table.schema)
+        elif not table.schema.equals(self.schema):
+            try:
+                table = table.cast(self.schema)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+                self._widen(table.schema)
+                table = table.cast(self.schema)
+        self._append(table)
+
+    def _widen(self, incoming):
+        import pyarrow as pa
+
+        if incoming.names != self.schema.names:
+            raise ValueError("Los bloques del dataset no tienen las mismas columnas")
+        schema = pa.schema([
+            pa.field(field.name, _widen_type(field.type, other.type))
+            for field, other in zip(self.schema, incoming)
+        ])
+        self.close()
+        old_path = f"{self.path}.old"
+        os.replace(self.path, old_path)
+        try:
+            self._open(schema)
+            with pa.memory_map(old_path) as source:
+                reader = pa.ipc.open_file(source)
+                for i in range(reader.num_record_batches):
+                    self._append(pa.Table.from_batches([reader.get_batch(i)]).cast(schema))
+        finally:
+            os.unlink(old_path)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._file.close()
+            self._writer = self._file = None
+
+    def finish(self) -> Optional[Dict]:
+        """Cierra el fichero y devuelve el perfil (None si no se pidió)."""
+        if self.schema is None:
+            raise ValueError("El archivo no contiene columnas")
+        self.close()
+        return self._acc.finish(PROFILE_CORRELATION_TOP_K) if self._acc is not None else None
+
+
+def _write_csv_streaming(buffer: io.BytesIO, sink: _FeatherSink):
+    """CSV -> Feather por bloques con el lector multihilo de pyarrow (memoria acotada)."""
+    import pyarrow as pa
+    from pyarrow import csv
+
+    buffer.seek(0)
+    # Celdas vacías como nulos también en columnas de texto, igual que pandas
+    reader = csv.open_csv(buffer, convert_options=csv.ConvertOptions(strings_can_be_null=True))
+    sink.write(reader.schema.empty_table())
+    for batch in reader:
+        sink.write(pa.Table.from_batches([batch]))
+
+
+def _write_csv_chunked(buffer: io.BytesIO, sink: _FeatherSink):
+    """CSV -> Feather con pandas por bloques de `DATA_CHUNK_ROWS` filas."""
+    import pandas as pd
+
+    buffer.seek(0)
+    for chunk in pd.read_csv(buffer, chunksize=DATA_CHUNK_ROWS, engine="c"):
+        sink.write(_frame_to_table(chunk))
+
+
+def _write_xlsx_streaming(buffer: io.BytesIO, sink: _FeatherSink):
+    """XLSX -> Feather recorriendo la primera hoja con openpyxl en modo solo lectura."""
+    import pandas as pd
+    from openpyxl import load_workbook
+
+    def flush(rows: List[tuple]):
+        frame = pd.DataFrame.from_records(rows, columns=columns) if rows else pd.DataFrame(columns=columns)
+        sink.write(_frame_to_table(frame.infer_objects()))
+
+    buffer.seek(0)
+    workbook = load_workbook(buffer, read_only=True, data_only=True)
+    try:
+        rows_iter = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows_iter, None) or ()
+        columns = [str(c) if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+        rows: List[tuple] = []
+        for row in rows_iter:
+            rows.append(row)
+            if len(rows) >= DATA_CHUNK_ROWS:
+                flush(rows)
+                rows = []
+        if rows or sink.schema is None:
+            flush(rows)
+    finally:
+        workbook.close()
+
+
+def _write_xls(buffer: io.BytesIO, sink: _FeatherSink):
+    """Los .xls antiguos (máx. 65 536 filas) se leen enteros con pandas."""
+    from file_processor import load_dataframe
+
+    buffer.seek(0)
+    df = load_dataframe(buffer, ".xls")
+    for start in range(0, max(len(df), 1), DATA_CHUNK_ROWS):
+        sink.write(_frame_to_table(df.iloc[start:start + DATA_CHUNK_ROWS]))
+
+
+def _convert(buffer: io.BytesIO, name: str, tmp_path: str, profile: bool) -> Optional[Dict]:
+    lower = name.lower()
+    if lower.endswith(".csv"):
+        sink = _FeatherSink(tmp_path, profile)
+        try:
+            _write_csv_streaming(buffer, sink)
+            return sink.finish()
+        except Exception:
+            sink.close()  # tipos que cambian a mitad de fichero: se recurre a pandas por bloques
+        write = _write_csv_chunked
+    elif lower.endswith(".xlsx"):
+        write = _write_xlsx_streaming
+    elif lower.endswith(".xls"):
+        write = _write_xls
+    else:
+        raise ValueError("Formato no soportado. Use .xlsx, .xls o .csv")
+    sink = _FeatherSink(tmp_path, profile)
+    try:
+        write(buffer, sink)
+        return sink.finish()
+    finally:
+        sink.close()
+
+
+def _store(buffer: io.BytesIO, name: str, key: str, profile: bool) -> Tuple[str, Optional[Dict]]:
+    path = dataset_path(key)
+    if os.path.exists(path):
+        os.utime(path)
+        return path, None
+    os.makedirs(DATASET_STORE_DIR, exist_ok=True)
+    # Pid + hilo: la conversión puede correr en varios procesos de ingesta a la vez
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        result = _convert(buffer, name, tmp_path, profile)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    _evict()
+    return path, result
+
+
+def store_dataset(buffer: io.BytesIO, name: str, key: str) -> str:
+    """
+    Convierte un CSV/XLSX a Feather si aún no está en el almacén.
+
+    El archivo se lee una sola vez y se escribe por bloques: ni el CSV ni la
+    hoja de cálculo se cargan enteros en memoria (salvo los .xls antiguos).
+
+    Args:
+        buffer: Contenido del archivo
+        name: Nombre del archivo (define el formato)
+        key: Hash del contenido (ver `file_processor.content_digest`)
+
+    Returns:
+        Ruta del fichero Feather
+    """
+    return _store(buffer, name, key, profile=False)[0]
+
+
+def store_and_profile_dataset(buffer: io.BytesIO, name: str, key: str) -> Tuple[str, Dict]:
+    """
+    Como `store_dataset`, pero devuelve también el perfil del dataset.
+
+    El perfil se calcula sobre los mismos bloques que se escriben en el
+    Feather; si el dataset ya estaba en el almacén, se calcula sobre la copia
+    columnar sin volver a leer el original.
+
+    Returns:
+        (ruta del fichero Feather, perfil de `data_profiler.profile_chunks`)
+    """
+    path, profile = _store(buffer, name, key, profile=True)
+    if profile is None:
+        from data_profiler import profile_chunks
+
+        profile = profile_chunks(iter_dataset_chunks(key))
+    return path, profile
+
+
+def _evict():
+    """Borra los datasets usados hace más tiempo si el almacén supera el tamaño máximo."""
+    if not DATASET_STORE_MAX_MB:
+        return
+    entries = []
+    for entry in os.scandir(DATASET_STORE_DIR):
+        if entry.name.endswith(".feather"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    excess = sum(size for _, size, _ in entries) - DATASET_STORE_MAX_MB * 1024 * 1024
+    for _, size, path in sorted(entries):
+        if excess <= 0:
+            break
+        with _lock:
+            _open_tables.pop(path, None)
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        excess -= size
+
+
+def _open_table(key: str):
+    """Tabla Arrow del dataset abierta con memory-map (no copia los datos)."""
+    from pyarrow import feather
+
+    path = dataset_path(key)
+    with _lock:
+        table = _open_tables.get(path)
+        if table is not None:
+            _open_tables.move_to_end(path)
+            return table
+    if not os.path.exists(path):
+        raise KeyError(f"Dataset no encontrado en el almacén: {key}")
+    table = feather.read_table(path, memory_map=True)
+    os.utime(path)
+    with _lock:
+        _open_tables[path] = table
+        while len(_open_tables) > _OPEN_TABLES_MAX:
+            _open_tables.popitem(last=False)
+    return table
+
+
+def dataset_columns(key: str) -> List[str]:
+    return list(_open_table(key).column_names)
+
+
+def iter_dataset_chunks(key: str, columns: Optional[List[str]] = None) -> Iterator["pd.DataFrame"]:
+    """Recorre un dataset del almacén por lotes de registros (sin cargarlo entero)."""
+    table = _open_table(key)
+    if columns is not None:
+        table = table.select([c for c in dict.fromkeys(columns)])
+    for batch in table.to_batches():
+        yield batch.to_pandas()
+
+
+def open_dataset(key: str, columns: Optional[List[str]] = None) -> "pd.DataFrame":
+    """
+    DataFrame con las columnas pedidas de un dataset del almacén.
+
+    Solo se materializan las columnas indicadas; el resto del fichero no se
+    lee de disco.
+    """
+    table = _open_table(key)
+    if columns is not None:
+        table = table.select([c for c in dict.fromkeys(columns)])
+    return table.to_pandas()
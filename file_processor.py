@@ -3,43 +3,272 @@ Procesamiento de archivos: PDF, Excel/CSV, imágenes y textos.
 """
 
 import base64
-import os
-import tempfile
-from typing import Dict, List, Optional, Tuple
+import hashlib
+import io
+import multiprocessing
+import signal
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import CancelledError, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
 
-import pandas as pd
-from PIL import Image
-from pypdf import PdfReader
-from docx import Document
+from cache_store import SQLiteCache, content_key
+from config import (
+    PDF_PARALLEL_MIN_PAGES,
+    PDF_WORKERS,
+    PDF_PAGE_TIMEOUT_S,
+    CACHE_DB_PATH,
+    ATTACHMENT_CACHE_ENABLED,
+    ATTACHMENT_CACHE_MAX_MB,
+    INGEST_WORKERS,
+    INGEST_PROCESSES,
+    INGEST_FILE_TIMEOUT_S,
+    IMAGE_MAX_SIDE_PX,
+    IMAGE_SHORT_SIDE_PX,
+    IMAGE_JPEG_QUALITY,
+    IMAGE_DETAIL,
+    IMAGE_LOW_DETAIL_MAX_PX,
+    DATA_SAMPLE_ROWS,
+    DATA_CHUNK_ROWS,
+)
+from dataset_store import has_dataset, store_and_profile_dataset
+from token_counter import estimate_vision_tokens
+
+# pandas, PIL, pypdf, python-docx y data_profiler (numpy) se importan dentro de
+# cada parser: así el arranque de la app no paga su carga si el usuario solo chatea.
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 PREVIEW_CHAR_LIMIT = 5000  # evitamos prompts gigantes
 
+# Subir al cambiar cualquier parser: invalida los contextos guardados en caché
+PARSER_VERSION = 6
+
+_attachment_cache: Optional[SQLiteCache] = None
+_attachment_cache_lock = threading.Lock()
+
 
-def process_pdf(pdf_file) -> str:
+def as_buffer(upload) -> io.BytesIO:
+    """
+    Devuelve la subida como BytesIO sin pasar por disco.
+
+    Los UploadedFile de Streamlit ya son BytesIO: se rebobinan y se usan tal
+    cual, sin copiar. Cualquier otro objeto de archivo se lee una sola vez.
+    """
+    if isinstance(upload, io.BytesIO):
+        upload.seek(0)
+        return upload
+    data = upload.read()
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    buffer = io.BytesIO(data)
+    buffer.name = getattr(upload, "name", "archivo_sin_nombre")
+    return buffer
+
+
+def get_attachment_cache() -> Optional[SQLiteCache]:
+    """Caché en disco de adjuntos procesados; None si está desactivada (SANAL_ATTACHMENT_CACHE=0)."""
+    global _attachment_cache
+    if not ATTACHMENT_CACHE_ENABLED:
+        return None
+    with _attachment_cache_lock:
+        if _attachment_cache is None:
+            _attachment_cache = SQLiteCache(
+                CACHE_DB_PATH,
+                table="attachments",
+                max_bytes=int(ATTACHMENT_CACHE_MAX_MB * 1024 * 1024),
+            )
+    return _attachment_cache
+
+
+def content_digest(buffer: io.BytesIO) -> str:
+    """sha256 del contenido de la subida (sin copiar los bytes)."""
+    with buffer.getbuffer() as view:
+        return hashlib.sha256(view).hexdigest()
+
+
+def attachment_cache_key(digest: str, name: str) -> str:
+    """Clave por contenido: sha256 de los bytes, extensión y versión de los parsers."""
+    extension = name.lower().rsplit(".", 1)[-1] if "." in name else ""
+    return content_key({
+        "sha256": digest,
+        "extension": extension,
+        "parser_version": PARSER_VERSION,
+        "preview_chars": PREVIEW_CHAR_LIMIT,
+    })
+
+
+# Lector del PDF en cada proceso del pool (se carga una vez por proceso)
+_worker_reader = None
+
+
+def _init_pdf_worker(data: bytes):
+    global _worker_reader
+    from pypdf import PdfReader
+
+    _worker_reader = PdfReader(io.BytesIO(data))
+
+
+def _extract_page_worker(index: int) -> str:
+    return _worker_reader.pages[index].extract_text() or ""
+
+
+def _new_pdf_pool(data: bytes, workers: int) -> ProcessPoolExecutor:
+    # spawn: el proceso de Streamlit tiene hilos y fork no es seguro
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_pdf_worker,
+        initargs=(data,),
+    )
+
+
+def _terminate_pool(pool: ProcessPoolExecutor):
+    """Cierra el pool matando sus procesos: un worker colgado en una página no acaba solo."""
+    processes = list((getattr(pool, "_processes", None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for proc in processes:
+        if proc.is_alive():
+            proc.terminate()
+
+
+class _PageTimeout(Exception):
+    pass
+
+
+@contextmanager
+def _page_deadline(seconds: float):
+    """
+    Interrumpe con SIGALRM la página que tarda más de `seconds`.
+
+    Solo es posible en el hilo principal de un proceso POSIX, que es donde se
+    ejecutan los procesos de ingesta; en otro hilo la página no tiene límite.
+    """
+    usable = seconds > 0 and hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+    if not usable:
+        yield
+        return
+
+    def on_alarm(signum, frame):
+        raise _PageTimeout()
+
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def extract_pdf_pages(
+    buffer: io.BytesIO,
+    max_chars: Optional[int] = None,
+    workers: int = PDF_WORKERS,
+    page_timeout_s: float = PDF_PAGE_TIMEOUT_S,
+    parallel_min_pages: int = PDF_PARALLEL_MIN_PAGES,
+) -> Tuple[List[str], Dict]:
+    """
+    Extrae el texto de las páginas de un PDF, en orden.
+
+    Con `max_chars` (vista previa) se extrae en serie y se para en cuanto las
+    páginas obtenidas superan ese número de caracteres: arrancar un pool que
+    vuelve a leer el PDF en cada proceso cuesta más que las pocas páginas que
+    hacen falta. En la extracción completa, los PDFs con al menos
+    `parallel_min_pages` páginas se reparten página a página en un pool de
+    procesos. En ambos modos una página que tarda más de `page_timeout_s` o
+    falla se deja vacía y se cuenta en las estadísticas; en el pool, tras un
+    timeout el pool se recicla para no dejar el proceso colgado, y en serie
+    la página se interrumpe (ver `_page_deadline`).
+
+    Returns:
+        (textos de las páginas extraídas, estadísticas con pages, extracted,
+        parallel, timeouts, failed y stopped_early)
+    """
+    from pypdf import PdfReader
+
+    reader = PdfReader(buffer)
+    n_pages = len(reader.pages)
+    parallel = max_chars is None and workers > 1 and n_pages >= parallel_min_pages
+    stats = {"pages": n_pages, "extracted": 0, "parallel": parallel, "timeouts": 0, "failed": 0, "stopped_early": False}
+    texts: List[str] = []
+    collected = 0
+
+    def add(text: str) -> bool:
+        nonlocal collected
+        texts.append(text)
+        collected += len(text) + 1
+        return max_chars is not None and collected >= max_chars
+
+    if not parallel:
+        for index in range(n_pages):
+            try:
+                with _page_deadline(page_timeout_s):
+                    text = reader.pages[index].extract_text() or ""
+            except _PageTimeout:
+                stats["timeouts"] += 1
+                text = ""
+            except Exception:
+                stats["failed"] += 1
+                text = ""
+            if add(text):
+                break
+    else:
+        data = buffer.getvalue()
+        pool = _new_pdf_pool(data, workers)
+        pending = deque()
+        next_page = 0
+        try:
+            while next_page < n_pages or pending:
+                # Ventana acotada de páginas en vuelo
+                while next_page < n_pages and len(pending) < workers * 2:
+                    pending.append((next_page, pool.submit(_extract_page_worker, next_page)))
+                    next_page += 1
+                _, future = pending.popleft()
+                try:
+                    text = future.result(timeout=page_timeout_s)
+                except FutureTimeoutError:
+                    stats["timeouts"] += 1
+                    text = ""
+                    # El proceso sigue atascado en esa página: se mata el pool y
+                    # las páginas en vuelo sin terminar se reenvían a uno nuevo
+                    in_flight = [(page, f, f.done()) for page, f in pending]
+                    _terminate_pool(pool)
+                    pool = _new_pdf_pool(data, workers)
+                    pending = deque(
+                        (page, f if done else pool.submit(_extract_page_worker, page))
+                        for page, f, done in in_flight
+                    )
+                except Exception:
+                    stats["failed"] += 1
+                    text = ""
+                add(text)
+        finally:
+            _terminate_pool(pool)
+
+    stats["extracted"] = len(texts)
+    stats["stopped_early"] = len(texts) < n_pages
+    return texts, stats
+
+
+def process_pdf(pdf_file, max_chars: Optional[int] = None) -> str:
     """
     Extrae texto de un PDF.
     
     Args:
         pdf_file: Objeto de archivo PDF desde Streamlit
+        max_chars: Si se indica, deja de extraer páginas al superar ese tamaño
     
     Returns:
         Texto extraído del PDF
     """
     try:
-        # Guardar temporalmente el archivo
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(pdf_file.read())
-            tmp_path = tmp.name
-        
-        # Leer PDF
-        reader = PdfReader(tmp_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        
-        # Limpiar
-        os.unlink(tmp_path)
+        # Leer PDF directamente del buffer subido
+        pages, _ = extract_pdf_pages(as_buffer(pdf_file), max_chars=max_chars)
+        text = "\n".join(pages)
         
         return text if text.strip() else "El PDF no contiene texto extractable."
     except Exception as e:
@@ -51,13 +280,10 @@ def process_docx(docx_file) -> str:
     Extrae texto de un DOCX.
     """
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
-            tmp.write(docx_file.read())
-            tmp_path = tmp.name
+        from docx import Document
 
-        document = Document(tmp_path)
+        document = Document(as_buffer(docx_file))
         paragraphs = [p.text for p in document.paragraphs if p.text.strip()]
-        os.unlink(tmp_path)
         text = "\n".join(paragraphs)
         return text if text.strip() else "El DOCX no contiene texto legible."
     except Exception as e:
@@ -77,43 +303,249 @@ def process_text(text_file) -> str:
         return f"Error procesando texto: {str(e)}"
 
 
-def process_excel_csv(file) -> Tuple[pd.DataFrame, str]:
+def _scan_csv(buffer: io.BytesIO, sample_rows: int, chunk_rows: int, count_rows: bool = True) -> Tuple["pd.DataFrame", Optional[int]]:
+    import pandas as pd
+
+    buffer.seek(0)
+    sample = pd.read_csv(buffer, nrows=sample_rows, engine="c")
+    if len(sample) < sample_rows:
+        return sample, len(sample)
+    if not count_rows:
+        return sample, None
+    try:
+        return sample, _count_csv_rows_arrow(buffer, len(sample.columns))
+    except Exception:
+        pass  # filas con más campos que la cabecera, etc.: se cuenta con pandas
+    # Conteo de filas por bloques: solo se convierte la primera columna
+    buffer.seek(0)
+    rows = 0
+    for chunk in pd.read_csv(buffer, usecols=[0], dtype=str, chunksize=chunk_rows, engine="c"):
+        rows += len(chunk)
+    return sample, rows
+
+
+def _count_csv_rows_arrow(buffer: io.BytesIO, n_columns: int) -> int:
+    """Filas de datos de un CSV con el lector en streaming de pyarrow (solo la primera columna, como texto)."""
+    import pyarrow as pa
+    from pyarrow import csv
+
+    names = [f"c{i}" for i in range(n_columns)]
+    buffer.seek(0)
+    reader = csv.open_csv(
+        buffer,
+        read_options=csv.ReadOptions(skip_rows=1, column_names=names),
+        parse_options=csv.ParseOptions(newlines_in_values=True),
+        convert_options=csv.ConvertOptions(include_columns=names[:1], column_types={names[0]: pa.string()}),
+    )
+    return sum(batch.num_rows for batch in reader)
+
+
+def _scan_xlsx(buffer: io.BytesIO, sample_rows: int, count_rows: bool = True) -> Tuple["pd.DataFrame", Optional[int]]:
+    import pandas as pd
+    from openpyxl import load_workbook
+
+    buffer.seek(0)
+    workbook = load_workbook(buffer, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        rows_iter = sheet.iter_rows(values_only=True)
+        header = next(rows_iter, None) or ()
+        columns = [str(c) if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+        sample = []
+        for row in rows_iter:
+            sample.append(row)
+            if len(sample) >= sample_rows:
+                break
+        if len(sample) < sample_rows:
+            rows = len(sample)
+        elif sheet.max_row:
+            # Dimensión declarada en el fichero: no hace falta recorrerlo
+            rows = sheet.max_row - 1
+        elif count_rows:
+            rows = len(sample) + sum(1 for _ in rows_iter)
+        else:
+            rows = None
+    finally:
+        workbook.close()
+    frame = pd.DataFrame.from_records(sample, columns=columns) if sample else pd.DataFrame(columns=columns)
+    return frame.infer_objects(), rows
+
+
+def scan_tabular(
+    buffer: io.BytesIO,
+    name: str,
+    sample_rows: int = DATA_SAMPLE_ROWS,
+    chunk_rows: int = DATA_CHUNK_ROWS,
+    count_rows: bool = True,
+) -> Dict:
     """
-    Lee un archivo Excel o CSV.
-    
+    Esquema y vista previa de un CSV/XLSX sin cargar el fichero completo.
+
+    Los tipos se infieren de las primeras `sample_rows` filas; el número de
+    filas se obtiene leyendo el CSV por bloques o de la dimensión de la hoja
+    (openpyxl en modo solo lectura). Con `count_rows=False` no se recorre el
+    fichero para contarlas y `rows` queda en None si no se conoce ya. Los .xls
+    antiguos (máx. 65 536 filas) se leen enteros.
+
+    Returns:
+        Dict con rows, columns, dtypes (de la muestra), sample_rows y preview
+    """
+    import pandas as pd
+
+    lower = name.lower()
+    if lower.endswith(".csv"):
+        sample, rows = _scan_csv(buffer, sample_rows, chunk_rows, count_rows)
+    elif lower.endswith(".xlsx"):
+        sample, rows = _scan_xlsx(buffer, sample_rows, count_rows)
+    elif lower.endswith(".xls"):
+        buffer.seek(0)
+        full = pd.read_excel(buffer)
+        sample, rows = full.head(sample_rows), len(full)
+    else:
+        raise ValueError("Formato no soportado. Use .xlsx, .xls o .csv")
+
+    return {
+        "rows": rows,
+        "columns": [str(c) for c in sample.columns],
+        "dtypes": {str(c): str(t) for c, t in sample.dtypes.items()},
+        "sample_rows": len(sample),
+        "preview": sample.head().to_string(),
+    }
+
+
+def load_dataframe(file, name: Optional[str] = None, columns: Optional[List[str]] = None) -> "pd.DataFrame":
+    """
+    Carga completa (bajo demanda) de un CSV/XLSX para el análisis estadístico.
+
     Args:
-        file: Objeto de archivo desde Streamlit
-    
+        file: Objeto de archivo o buffer con el CSV/XLSX
+        name: Nombre del archivo (por defecto `file.name`)
+        columns: Columnas a leer; None = todas
+
     Returns:
-        Tuple (DataFrame, descripción)
+        DataFrame
     """
-    try:
-        filename = file.name.lower()
-        
-        if filename.endswith(".xlsx") or filename.endswith(".xls"):
-            df = pd.read_excel(file)
-        elif filename.endswith(".csv"):
-            df = pd.read_csv(file)
-        else:
-            return None, "Formato no soportado. Use .xlsx, .xls o .csv"
-        
-        # Información básica
-        info = f"""
+    import pandas as pd
+
+    buffer = as_buffer(file)
+    lower = (name or getattr(file, "name", "")).lower()
+    if lower.endswith(".csv"):
+        chunks = pd.read_csv(buffer, usecols=columns, chunksize=DATA_CHUNK_ROWS, engine="c")
+        return pd.concat(chunks, ignore_index=True)
+    if lower.endswith((".xlsx", ".xls")):
+        return pd.read_excel(buffer, usecols=columns)
+    raise ValueError("Formato no soportado. Use .xlsx, .xls o .csv")
+
+
+def _describe_tabular(schema: Dict) -> str:
+    # Información básica
+    return f"""
         Datos cargados exitosamente.
-        - Dimensiones: {df.shape[0]} filas × {df.shape[1]} columnas
-        - Columnas: {', '.join(df.columns.tolist())}
-        - Tipos de datos: {df.dtypes.to_dict()}
+        - Dimensiones: {schema['rows']} filas × {len(schema['columns'])} columnas
+        - Columnas: {', '.join(schema['columns'])}
+        - Tipos de datos (primeras {schema['sample_rows']} filas): {schema['dtypes']}
         
         Primeras filas:
-        {df.head().to_string()}
+        {schema['preview']}
         """
 
-        return df, info
+
+def process_excel_csv(file, count_rows: bool = True) -> Tuple[Optional[Dict], str]:
+    """
+    Describe un archivo Excel o CSV sin materializarlo entero.
+    
+    Args:
+        file: Objeto de archivo desde Streamlit
+        count_rows: Ver `scan_tabular`
+    
+    Returns:
+        Tuple (esquema de `scan_tabular`, descripción)
+    """
+    try:
+        buffer = as_buffer(file)
+        schema = scan_tabular(buffer, getattr(file, "name", ""), count_rows=count_rows)
+        return schema, _describe_tabular(schema)
     except Exception as e:
         return None, f"Error procesando archivo: {str(e)}"
 
 
-def process_image(image_file) -> Tuple[Optional[str], str]:
+IMAGE_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+
+def _vision_target_size(width: int, height: int) -> Tuple[int, int]:
+    """Tamaño útil: el que el proveedor usaría tras su propio reescalado."""
+    if IMAGE_DETAIL == "low":
+        scale = min(1.0, IMAGE_LOW_DETAIL_MAX_PX / max(width, height))
+    else:
+        scale = min(1.0, IMAGE_MAX_SIDE_PX / max(width, height), IMAGE_SHORT_SIDE_PX / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _choose_detail(width: int, height: int) -> str:
+    if IMAGE_DETAIL in {"low", "high"}:
+        return IMAGE_DETAIL
+    return "low" if max(width, height) <= IMAGE_LOW_DETAIL_MAX_PX else "high"
+
+
+def preprocess_image(buffer: io.BytesIO) -> Dict:
+    """
+    Prepara una imagen para visión: reduce, reorienta y recodifica.
+
+    Las JPEG se decodifican en modo borrador (escalado DCT) directamente al
+    tamaño útil, sin descomprimir la foto completa. Las imágenes con
+    transparencia o paleta (gráficos, capturas) se guardan como PNG y el
+    resto como JPEG. Si el original ya es más pequeño y no hace falta
+    reducirlo, se envía tal cual.
+
+    Returns:
+        Dict con data (bytes), mime_type, detail, width, height,
+        original_bytes, sent_bytes, vision_tokens y original_vision_tokens
+    """
+    from PIL import Image, ImageOps
+
+    original_bytes = buffer.getbuffer().nbytes
+    with Image.open(buffer) as img:
+        source_format = img.format
+        orig_w, orig_h = img.size
+        target_w, target_h = _vision_target_size(orig_w, orig_h)
+        if source_format == "JPEG":
+            img.draft("RGB", (target_w, target_h))
+        img = ImageOps.exif_transpose(img)
+        # Tras la reorientación el ancho y el alto pueden haberse intercambiado
+        target_w, target_h = _vision_target_size(*img.size)
+        resized = img.size != (target_w, target_h)
+        if resized:
+            img = img.resize((target_w, target_h), Image.LANCZOS)
+
+        keep_png = img.mode in {"RGBA", "LA", "P", "1"} or (img.mode == "L" and source_format == "PNG")
+        out = io.BytesIO()
+        if keep_png:
+            img.save(out, format="PNG", optimize=True)
+            out_format = "PNG"
+        else:
+            img.convert("RGB").save(out, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True, progressive=True)
+            out_format = "JPEG"
+        width, height = img.size
+
+    data = out.getvalue()
+    if not resized and source_format in IMAGE_MIME_TYPES and original_bytes <= len(data):
+        data, out_format = buffer.getvalue(), source_format
+
+    detail = _choose_detail(width, height)
+    return {
+        "data": data,
+        "mime_type": IMAGE_MIME_TYPES[out_format],
+        "detail": detail,
+        "width": width,
+        "height": height,
+        "original_bytes": original_bytes,
+        "sent_bytes": len(data),
+        "vision_tokens": estimate_vision_tokens(width, height, detail),
+        "original_vision_tokens": estimate_vision_tokens(orig_w, orig_h, "high"),
+    }
+
+
+def process_image(image_file) -> Tuple[Optional[Dict], str]:
     """
     Procesa una imagen JPG/PNG.
     
@@ -121,114 +553,261 @@ def process_image(image_file) -> Tuple[Optional[str], str]:
         image_file: Objeto de archivo imagen desde Streamlit
     
     Returns:
-        Tuple (ruta temporal, descripción)
+        Tuple (imagen preparada por `preprocess_image`, descripción)
     """
     try:
-        # Guardar temporalmente
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-            tmp.write(image_file.read())
-            tmp_path = tmp.name
-
-        # Validar que es imagen
-        img = Image.open(tmp_path)
-        info = f"Imagen cargada: {img.format} {img.size[0]}×{img.size[1]} px"
+        prepared = preprocess_image(as_buffer(image_file))
+        saved_kb = (prepared["original_bytes"] - prepared["sent_bytes"]) / 1024
+        info = (
+            f"Imagen cargada: {prepared['width']}×{prepared['height']} px "
+            f"({prepared['mime_type']}, detalle {prepared['detail']}) • "
+            f"{prepared['sent_bytes'] / 1024:.0f} KB enviados, {saved_kb:.0f} KB ahorrados • "
+            f"~{prepared['vision_tokens']} tokens de visión (original ~{prepared['original_vision_tokens']})"
+        )
 
-        return tmp_path, info
+        return prepared, info
     except Exception as e:
         return None, f"Error procesando imagen: {str(e)}"
 
 
-def get_dataframe_info(df: pd.DataFrame) -> dict:
+def get_dataframe_info(df: "pd.DataFrame", correlation_top_k: int = 0) -> dict:
     """
     Obtiene información estadística básica del DataFrame.
+
+    Una sola pasada por bloques (ver `data_profiler`); la correlación es
+    opcional y se limita a las `correlation_top_k` columnas numéricas.
     
     Args:
         df: DataFrame a analizar
+        correlation_top_k: Columnas en la correlación (0 = sin correlación)
     
     Returns:
-        Diccionario con información
+        Perfil con rows, columns, column_stats y, si procede, correlation
     """
-    return {
-        "shape": df.shape,
-        "columns": df.columns.tolist(),
-        "dtypes": df.dtypes.to_dict(),
-        "missing": df.isnull().sum().to_dict(),
-        "describe": df.describe().to_dict(),
-        "correlation": df.corr(numeric_only=True).to_dict() if len(df.select_dtypes(include=['number']).columns) > 1 else {}
-    }
+    from data_profiler import profile_dataframe
+
+    return profile_dataframe(df, correlation_top_k=correlation_top_k)
 
 
 def _truncate(text: str, limit: int = PREVIEW_CHAR_LIMIT) -> str:
     return text if len(text) <= limit else text[:limit] + "\n...[truncado]"
 
 
-def _encode_image_base64(image_path: str) -> str:
-    with open(image_path, "rb") as f:
-        return base64.standard_b64encode(f.read()).decode("utf-8")
+def _encode_image_base64(data: bytes) -> str:
+    return base64.standard_b64encode(data).decode("ascii")
 
 
-def prepare_context_from_files(files: List) -> List[Dict]:
-    """
-    Procesa múltiples archivos subidos y devuelve una lista de contextos homogéneos
-    para alimentar al modelo.
-    """
-    contexts = []
-    for file in files:
-        name = getattr(file, "name", "archivo_sin_nombre")
-        lower = name.lower()
-        ctx: Dict = {"name": name}
+def _process_upload(buffer: io.BytesIO, name: str, digest: Optional[str] = None) -> Dict:
+    """Contexto de un único archivo; nunca lanza excepciones."""
+    lower = name.lower()
+    ctx: Dict = {"name": name}
 
-        try:
-            if lower.endswith(".pdf"):
-                text = process_pdf(file)
-                ctx.update({
-                    "kind": "pdf",
-                    "summary": _truncate(text),
-                    "content": _truncate(text)
-                })
-            elif lower.endswith((".docx")):
-                text = process_docx(file)
-                ctx.update({
-                    "kind": "docx",
-                    "summary": _truncate(text),
-                    "content": _truncate(text)
-                })
-            elif lower.endswith((".txt", ".md")):
-                text = process_text(file)
-                ctx.update({
-                    "kind": "text",
-                    "summary": _truncate(text),
-                    "content": _truncate(text)
-                })
-            elif lower.endswith((".csv", ".xlsx", ".xls")):
-                df, info = process_excel_csv(file)
-                preview = info if info else "No se pudo generar preview"
-                ctx.update({
-                    "kind": "data",
-                    "summary": _truncate(preview),
-                    "dataframe_info": preview,
-                })
-            elif lower.endswith((".jpg", ".jpeg", ".png", ".webp")):
-                path, info = process_image(file)
-                b64 = _encode_image_base64(path) if path else None
-                if path and os.path.exists(path):  # limpiar temporal
-                    os.unlink(path)
-                ctx.update({
-                    "kind": "image",
-                    "summary": info,
-                    "base64": b64,
-                })
-            else:
+    try:
+        if lower.endswith(".pdf"):
+            # Solo se usa la vista previa: no hace falta extraer el resto
+            text = process_pdf(buffer, max_chars=PREVIEW_CHAR_LIMIT + 1)
+            ctx.update({
+                "kind": "pdf",
+                "summary": _truncate(text),
+                "content": _truncate(text)
+            })
+        elif lower.endswith((".docx")):
+            text = process_docx(buffer)
+            ctx.update({
+                "kind": "docx",
+                "summary": _truncate(text),
+                "content": _truncate(text)
+            })
+        elif lower.endswith((".txt", ".md")):
+            text = process_text(buffer)
+            ctx.update({
+                "kind": "text",
+                "summary": _truncate(text),
+                "content": _truncate(text)
+            })
+        elif lower.endswith((".csv", ".xlsx", ".xls")):
+            # Las filas se cuentan al convertir: no hace falta otra pasada
+            schema, info = process_excel_csv(buffer, count_rows=False)
+            profile = None
+            if schema is not None:
+                # Copia columnar para statistical_analyzer (se convierte una sola vez) y
+                # estadísticos del dataset completo sobre los mismos bloques
+                digest = digest or content_digest(buffer)
+                try:
+                    _, profile = store_and_profile_dataset(buffer, name, digest)
+                    ctx["dataset_key"] = digest
+                    schema["rows"] = profile["rows"]
+                except Exception:
+                    pass  # la vista previa sigue siendo útil sin la copia columnar
+                if schema["rows"] is None:
+                    schema["rows"] = scan_tabular(buffer, name)["rows"]
+                info = _describe_tabular(schema)
+            preview = info if info else "No se pudo generar preview"
+            ctx.update({
+                "kind": "data",
+                "summary": _truncate(preview),
+                "dataframe_info": preview,
+            })
+            if schema is not None:
+                ctx["schema"] = {k: schema[k] for k in ("rows", "columns", "dtypes")}
+            if profile is not None:
+                from data_profiler import format_profile
+
+                ctx["profile"] = format_profile(profile)
+                ctx["dataframe_info"] = f"{preview}\n{ctx['profile']}"
+        elif lower.endswith((".jpg", ".jpeg", ".png", ".webp")):
+            prepared, info = process_image(buffer)
+            ctx.update({"kind": "image", "summary": info, "base64": None})
+            if prepared is not None:
                 ctx.update({
-                    "kind": "unknown",
-                    "summary": "Formato no soportado aún. Adjunta PDF, DOCX, TXT, CSV/XLSX, JPG/PNG.",
+                    "base64": _encode_image_base64(prepared["data"]),
+                    "mime_type": prepared["mime_type"],
+                    "detail": prepared["detail"],
+                    "original_bytes": prepared["original_bytes"],
+                    "sent_bytes": prepared["sent_bytes"],
+                    "vision_tokens": prepared["vision_tokens"],
+                    "original_vision_tokens": prepared["original_vision_tokens"],
                 })
-        except Exception as e:  # protegemos la sesión si un archivo falla
+        else:
             ctx.update({
-                "kind": "error",
-                "summary": f"Error procesando {name}: {str(e)}"
+                "kind": "unknown",
+                "summary": "Formato no soportado aún. Adjunta PDF, DOCX, TXT, CSV/XLSX, JPG/PNG.",
             })
+    except Exception as e:  # protegemos la sesión si un archivo falla
+        ctx.update({
+            "kind": "error",
+            "summary": f"Error procesando {name}: {str(e)}"
+        })
+
+    return ctx
+
+
+def _is_cacheable(ctx: Dict) -> bool:
+    # Los parsers devuelven sus errores como texto: no se guardan para reintentar
+    if ctx.get("kind") in {"error", "unknown"}:
+        return False
+    return not str(ctx.get("summary", "")).startswith("Error procesando")
+
+
+# Parsers en Python puro o con mucho trabajo bajo el GIL: van a procesos de ingesta
+CPU_BOUND_EXTENSIONS = (".pdf", ".docx", ".csv", ".xlsx", ".xls")
+
+_ingest_pool: Optional[ProcessPoolExecutor] = None
+_ingest_pool_lock = threading.Lock()
+
+
+def _get_ingest_pool() -> ProcessPoolExecutor:
+    """Pool de procesos de ingesta compartido; se crea en el primer uso y se mantiene caliente."""
+    global _ingest_pool
+    with _ingest_pool_lock:
+        if _ingest_pool is None:
+            _ingest_pool = ProcessPoolExecutor(
+                max_workers=max(1, INGEST_PROCESSES),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _ingest_pool
+
+
+def _recycle_ingest_pool(pool: ProcessPoolExecutor):
+    global _ingest_pool
+    with _ingest_pool_lock:
+        if _ingest_pool is pool:
+            _ingest_pool = None
+    _terminate_pool(pool)
+
+
+def _process_upload_bytes(data: bytes, name: str, digest: Optional[str]) -> Dict:
+    """Punto de entrada en el proceso de ingesta."""
+    buffer = io.BytesIO(data)
+    buffer.name = name
+    return _process_upload(buffer, name, digest)
+
+
+def _process_upload_in_process(buffer: io.BytesIO, name: str, digest: Optional[str]) -> Dict:
+    """
+    `_process_upload` en un proceso de ingesta, con límite de `INGEST_FILE_TIMEOUT_S`.
+
+    Si el archivo agota el tiempo, el pool se recicla (sus procesos se matan)
+    y el archivo se devuelve como error. Los archivos de otros hilos que
+    estaban en ese pool se reintentan una vez en el nuevo.
+    """
+    for _ in range(2):
+        pool = _get_ingest_pool()
+        try:
+            future = pool.submit(_process_upload_bytes, buffer.getvalue(), name, digest)
+            return future.result(timeout=INGEST_FILE_TIMEOUT_S)
+        except FutureTimeoutError:
+            _recycle_ingest_pool(pool)
+            return {"name": name, "kind": "error", "summary": f"Error procesando {name}: tiempo agotado ({INGEST_FILE_TIMEOUT_S:.0f} s)"}
+        except (BrokenProcessPool, CancelledError, RuntimeError):
+            # Pool reciclado por otro archivo o proceso caído: se reintenta con uno nuevo
+            _recycle_ingest_pool(pool)
+    return {"name": name, "kind": "error", "summary": f"Error procesando {name}: el proceso de ingesta terminó inesperadamente"}
+
+
+def _context_for_upload(file, cache: Optional[SQLiteCache]) -> Dict:
+    name = getattr(file, "name", "archivo_sin_nombre")
+    try:
+        buffer = as_buffer(file)
+        digest = content_digest(buffer)
+        key = attachment_cache_key(digest, name) if cache is not None else None
+    except Exception as e:
+        return {"name": name, "kind": "error", "summary": f"Error procesando {name}: {str(e)}"}
+
+    cached = cache.get_json(key) if key else None
+    # Si el dataset columnar se expulsó del almacén, se vuelve a procesar
+    if cached is not None and (not cached.get("dataset_key") or has_dataset(cached["dataset_key"])):
+        return {**cached, "name": name}
+    if INGEST_PROCESSES > 0 and name.lower().endswith(CPU_BOUND_EXTENSIONS):
+        ctx = _process_upload_in_process(buffer, name, digest)
+    else:
+        ctx = _process_upload(buffer, name, digest)
+    if key and _is_cacheable(ctx):
+        cache.put_json(key, ctx)
+    return ctx
+
+
+def prepare_context_from_files(
+    files: List,
+    progress: Optional[Callable[[int, int, str], None]] = None,
+    workers: int = INGEST_WORKERS,
+) -> List[Dict]:
+    """
+    Procesa múltiples archivos subidos y devuelve una lista de contextos homogéneos
+    para alimentar al modelo.
+
+    Cada archivo se identifica por el hash de su contenido: si ya se procesó
+    antes (en esta u otra sesión) se reutiliza el contexto guardado.
+
+    Los archivos se reparten en un pool de hilos acotado que hace la parte de
+    E/S (hash, caché, imágenes y texto). Los PDFs, DOCX y CSV/XLSX, cuyo
+    análisis no suelta el GIL, se procesan en un pool de procesos compartido
+    (`INGEST_PROCESSES`), con un límite de tiempo por archivo. El resultado
+    conserva el orden de `files` y un fallo solo afecta a su propio archivo.
+
+    Args:
+        files: Archivos subidos (UploadedFile de Streamlit u objetos de archivo)
+        progress: Llamada `progress(terminados, total, nombre)` por cada
+            archivo terminado; se ejecuta siempre en el hilo que llama a esta
+            función, así que puede actualizar widgets de Streamlit
+        workers: Archivos procesados a la vez
+    """
+    cache = get_attachment_cache()
+    contexts: List[Optional[Dict]] = [None] * len(files)
+
+    if workers <= 1 or len(files) <= 1:
+        for idx, file in enumerate(files):
+            contexts[idx] = _context_for_upload(file, cache)
+            if progress:
+                progress(idx + 1, len(files), contexts[idx]["name"])
+        return contexts
 
-        contexts.append(ctx)
+    with ThreadPoolExecutor(max_workers=min(workers, len(files)), thread_name_prefix="ingest") as pool:
+        futures = {pool.submit(_context_for_upload, file, cache): idx for idx, file in enumerate(files)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            idx = futures[future]
+            contexts[idx] = future.result()
+            if progress:
+                progress(done, len(files), contexts[idx]["name"])
 
     return contexts
@@ -4,17 +4,26 @@ Aplicación principal de Streamlit - Dr. Sanal, sistema académico sin límites
 
 import os
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterator, Union, Tuple
 
 import streamlit as st
 
 from prompts import get_system_prompt
 from openai_handler import (
     chat_with_sanal,
+    stream_chat_with_sanal,
     generate_academic_work_phased,
     build_context_block,
+    build_content_with_images,
+    build_attachment_prefix,
+    attachment_reference,
+    get_retry_stats,
+    DEFAULT_GRADING_QUESTION,
+    PHASE2_SECTIONS,
 )
 from file_processor import prepare_context_from_files
+from chat_history import compact_history, new_history_state
+from config import MODEL_SELECTION_RULES, ATTACHMENT_PREFIX_MODE
 
 
 # Configuración de la página
@@ -44,11 +53,12 @@ st.markdown(
 
 # Estado de sesión
 st.session_state.setdefault("chat_history", [])
+st.session_state.setdefault("history_state", new_history_state())
 st.session_state.setdefault("attachments", [])
 
 
 # Verificar API key
-if not os.getenv("OPENAI_API_KEY"):
+if not os.getenv("OPENAI_API_KEY") and not os.getenv("OPENAI_BASE_URL"):
     st.error("⚠️ ERROR: No se encontró OPENAI_API_KEY en las variables de entorno. Configura tu .env file")
     st.stop()
 
@@ -73,7 +83,12 @@ with st.sidebar:
     if col_up1.button("Añadir al contexto", use_container_width=True):
         if uploaded_files:
             with st.spinner("Procesando adjuntos..."):
-                processed = prepare_context_from_files(uploaded_files)
+                progress_bar = st.progress(0.0, text="Procesando adjuntos...")
+
+                def report_progress(done: int, total: int, name: str):
+                    progress_bar.progress(done / total, text=f"{done}/{total} • {name}")
+
+                processed = prepare_context_from_files(uploaded_files, progress=report_progress)
                 st.session_state.attachments.extend(processed)
                 st.success(f"{len(processed)} adjunto(s) listos")
                 st.rerun()
@@ -99,6 +114,15 @@ with st.sidebar:
         st.session_state.attachments = []
         st.rerun()
 
+    retry_info = get_retry_stats()
+    if any(info["retries"] or info["failures"] for info in retry_info.values()):
+        with st.expander("Reintentos de API por fase"):
+            for phase, info in retry_info.items():
+                st.markdown(
+                    f"`{phase}`: {info['calls']} llamadas • {info['retries']} reintentos • "
+                    f"{info['failures']} fallos • {info['wait_s']:.1f}s de espera"
+                )
+
     st.divider()
     st.markdown("### ℹ️ Comandos rápidos")
     st.markdown(
@@ -140,9 +164,22 @@ for message in st.session_state.chat_history:
     with st.chat_message("user" if message["role"] == "user" else "assistant"):
         st.markdown(message["content"])
 
+if st.session_state.get("last_stream_metrics", {}).get("ttft_s") is not None:
+    _m = st.session_state["last_stream_metrics"]
+    st.caption(f"⏱️ Primer token en {_m['ttft_s']:.2f}s • respuesta completa en {_m['total_s']:.1f}s ({_m['model']})")
+if (st.session_state.get("last_stream_metrics", {}).get("usage") or {}).get("cached_tokens"):
+    _u = st.session_state["last_stream_metrics"]["usage"]
+    st.caption(f"💾 {_u['cached_tokens']} de {_u['prompt_tokens']} tokens de entrada servidos desde la caché de prompts")
+if st.session_state.get("last_history_stats", {}).get("saved_tokens"):
+    _h = st.session_state["last_history_stats"]
+    st.caption(f"🗜️ Historial compactado: {_h['saved_tokens']} tokens ahorrados en el último turno ({_h['folded_messages']} mensajes resumidos)")
+
 
-def handle_command(user_text: str, context_block: str, language_choice: str, attachments: List[Dict]) -> str:
-    """Gestiona comandos especiales como /nota o /generar."""
+def handle_command(user_text: str, context_block: str, language_choice: str, attachments: List[Dict]) -> Union[str, Iterator[str]]:
+    """
+    Gestiona comandos especiales como /nota o /generar.
+    /nota devuelve un generador de fragmentos para pintarlo en streaming.
+    """
     lower = user_text.lower()
 
     if lower.startswith("/limpiar"):
@@ -151,20 +188,23 @@ def handle_command(user_text: str, context_block: str, language_choice: str, att
         st.rerun()
 
     if lower.startswith("/nota"):
-        question = user_text[len("/nota"):].strip() or "Califica el trabajo adjunto con nota 0-10 REAL basada en criterios UOC y justifica APA/metodología/coherencia."
+        question = user_text[len("/nota"):].strip() or DEFAULT_GRADING_QUESTION
         system_prompt = get_system_prompt("analysis")
         control = f"Idioma: {language_choice}." if language_choice != "Automático" else ""
         content = f"{context_block}\n\n{control}\n\nInstrucción: {question}"
         # Guardar texto para contador de tokens
         st.session_state["last_prompt_text"] = f"SYSTEM:\n{get_system_prompt('analysis')}\n\nUSER:\n{content}"
-        return chat_with_sanal(
-            messages=[{"role": "user", "content": build_content_with_images(content, attachments)}],
+        prefix_messages, turn_message = split_attachment_context(f"{control}\n\nInstrucción: {question}", context_block, attachments)
+        return stream_chat_with_sanal(
+            messages=[*prefix_messages, turn_message],
             system_prompt=system_prompt,
             temperature=0.7,
             max_tokens=3000,
             context="analysis",
             complexity=0.7,
             force_model=None,
+            metrics=st.session_state["last_stream_metrics"],
+            cacheable=True,
         )
 
     if lower.startswith("/generar"):
@@ -173,15 +213,24 @@ def handle_command(user_text: str, context_block: str, language_choice: str, att
         requirements = f"Usa los adjuntos como insumo. Detalles del usuario: {rest}"
         lang_hint = None if language_choice == "Automático" else ("ca" if language_choice == "Català" else ("es" if language_choice == "Castellano" else "en"))
 
+        section_stats: Dict[str, Dict] = {}
         work = generate_academic_work_phased(
             topic=topic,
             requirements=requirements,
             attachments=st.session_state.attachments,
             language_hint=lang_hint,
+            section_stats=section_stats,
         )
 
         st.markdown("## 📄 Trabajo Generado")
         st.markdown(work)
+        if section_stats:
+            # section_stats se rellena en orden de finalización; se muestra en el canónico
+            st.caption(" • ".join(
+                f"{sec}: {section_stats[sec]['seconds']:.1f}s"
+                + (f" (+{section_stats[sec]['continuations']} cont.)" if section_stats[sec].get("continuations") else "")
+                for sec in PHASE2_SECTIONS if sec in section_stats
+            ))
         st.divider()
         st.success("✓ Trabajo generado con arquitectura por fases (estable)", icon="✓")
         return ""
@@ -221,18 +270,20 @@ Si estaba en medio de una sección, complétala y continúa.
     )
 
 
-def build_content_with_images(text_block: str, attachments: List[Dict]) -> List[Dict]:
-    """Prepara contenido multimodal para OpenAI (texto + imágenes base64)."""
-    content: List[Dict] = [{"type": "text", "text": text_block}]
-    for att in attachments:
-        if att.get("kind") == "image" and att.get("base64"):
-            content.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{att['base64']}"
-                }
-            })
-    return content
+def split_attachment_context(text_block: str, context_block: str, attachments: List[Dict]) -> Tuple[List[Dict], Dict]:
+    """
+    Separa los adjuntos del mensaje del turno.
+
+    En modo prefijo los adjuntos van en un mensaje fijo al inicio y el turno
+    solo los referencia; si no, se antepone el bloque completo en cada turno.
+
+    Returns:
+        (mensajes de prefijo, mensaje del turno)
+    """
+    if ATTACHMENT_PREFIX_MODE and attachments:
+        turn_text = f"{attachment_reference(attachments)}\n\n{text_block}"
+        return build_attachment_prefix(attachments), {"role": "user", "content": turn_text}
+    return [], {"role": "user", "content": build_content_with_images(f"{context_block}\n\n{text_block}", attachments)}
 
 
 if user_input := st.chat_input("Escribe o usa comandos /nota, /generar"):
@@ -240,26 +291,31 @@ if user_input := st.chat_input("Escribe o usa comandos /nota, /generar"):
     context_block = build_context_block(st.session_state.attachments)
     control_block = f"Idioma seleccionado: {language_choice}."
 
+    st.session_state["last_stream_metrics"] = {}
+
     # Ejecutar comandos primero
     response = handle_command(user_input, context_block, language_choice, st.session_state.attachments)
 
     if not response:  # Chat normal
         system_prompt = get_system_prompt("chat")
-        user_content = build_content_with_images(
-            f"{context_block}\n\n{control_block}\n\nMensaje del estudiante: {user_input}",
+        prefix_messages, turn_message = split_attachment_context(
+            f"{control_block}\n\nMensaje del estudiante: {user_input}",
+            context_block,
             st.session_state.attachments,
         )
-        messages_for_api = st.session_state.chat_history + [
-            {
-                "role": "user",
-                "content": user_content,
-            }
-        ]
+        # Turnos recientes literales + resumen acumulado de los antiguos
+        history_messages, st.session_state["last_history_stats"] = compact_history(
+            st.session_state.chat_history,
+            model=MODEL_SELECTION_RULES["chat"],
+            state=st.session_state["history_state"],
+        )
+        # Orden estable para la caché de prompts: adjuntos, historial, turno actual
+        messages_for_api = prefix_messages + history_messages + [turn_message]
 
         # Guardar prompt para contador
         st.session_state["last_prompt_text"] = f"SYSTEM:\n{get_system_prompt('chat')}\n\nUSER:\n{context_block}\n\n{control_block}\n\nMensaje: {user_input}"
 
-        response = chat_with_sanal(
+        response = stream_chat_with_sanal(
             messages=messages_for_api,
             system_prompt=system_prompt,
             temperature=0.7,
@@ -267,8 +323,16 @@ if user_input := st.chat_input("Escribe o usa comandos /nota, /generar"):
             context="chat",
             complexity=0.5,
             force_model=None,
+            metrics=st.session_state["last_stream_metrics"],
         )
 
+    if not isinstance(response, str):
+        # Pintar la respuesta en vivo; write_stream devuelve el texto completo
+        with st.chat_message("user"):
+            st.markdown(user_input)
+        with st.chat_message("assistant"):
+            response = st.write_stream(response)
+
     st.session_state.chat_history.append(user_message)
     st.session_state.chat_history.append({"role": "assistant", "content": response})
     st.rerun()
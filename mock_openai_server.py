@@ -0,0 +1,294 @@
+"""
+Servidor local compatible con la API de chat completions de OpenAI.
+
+Sirve para probar y medir la aplicación sin clave ni coste:
+- synthetic: genera respuestas sintéticas con latencia y velocidad configurables
+- record: reenvía cada petición a la API real y la guarda en un fixture JSONL
+- replay: responde con las sesiones grabadas en el fixture
+
+Uso:
+    python mock_openai_server.py --port 8089 --latency 0.4 --tps 60 --error-rate 0.1
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 streamlit run main.py
+"""
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from cache_store import content_key
+
+
+LOREM = (
+    "Este trabajo se centra en analizar de forma prudente los resultados disponibles, "
+    "reconociendo las limitaciones de la muestra y la necesidad de estudios posteriores. "
+    "Segun los datos aportados, es posible que la relacion observada dependa del contexto "
+    "y no pueda generalizarse sin cautela."
+).split()
+
+
+def request_key(body: Dict) -> str:
+    """Clave de fixture: mismos campos que la caché de respuestas."""
+    return content_key({
+        "model": body.get("model"),
+        "messages": body.get("messages"),
+        "temperature": body.get("temperature"),
+        "max_tokens": body.get("max_tokens"),
+    })
+
+
+def _approx_tokens(text: str) -> int:
+    return max(1, len(text or "") // 4)
+
+
+def _prompt_tokens(messages: List[Dict]) -> int:
+    total = 0
+    for m in messages or []:
+        content = m.get("content", "")
+        if isinstance(content, list):
+            content = " ".join(p.get("text", "") for p in content if isinstance(p, dict))
+        total += _approx_tokens(str(content))
+    return total
+
+
+class MockState:
+    """Configuración y estado compartido entre los hilos del servidor."""
+
+    def __init__(self, args):
+        self.mode = args.mode
+        self.latency = args.latency
+        self.tps = args.tps
+        self.completion_tokens = args.completion_tokens
+        self.error_rate = args.error_rate
+        self.retry_after = args.retry_after
+        self.tpm_limit = args.tpm_limit
+        self.fixtures_path = args.fixtures
+        self.upstream = args.upstream.rstrip("/")
+        self.rng = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.fixtures: Dict[str, Dict] = {}
+        self.requests = 0
+        self.injected_429 = 0
+        if self.mode == "replay":
+            self._load_fixtures()
+
+    def _load_fixtures(self):
+        with open(self.fixtures_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    self.fixtures[item["key"]] = item["response"]
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            self.requests += 1
+            fail = self.rng.random() < self.error_rate
+            if fail:
+                self.injected_429 += 1
+            return fail
+
+    def record(self, key: str, body: Dict, response: Dict):
+        with self.lock:
+            with open(self.fixtures_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "request": body, "response": response}, ensure_ascii=False) + "\n")
+            self.fixtures[key] = response
+
+
+def synthetic_completion(state: MockState, body: Dict) -> Dict:
+    max_tokens = int(body.get("max_tokens") or 4096)
+    n = min(state.completion_tokens, max_tokens)
+    words = [LOREM[i % len(LOREM)] for i in range(n)]
+    content = " ".join(words)
+    finish_reason = "length" if state.completion_tokens > max_tokens else "stop"
+    if finish_reason == "stop":
+        content += "."
+    prompt_tokens = _prompt_tokens(body.get("messages"))
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": finish_reason,
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": n,
+            "total_tokens": prompt_tokens + n,
+        },
+    }
+
+
+def upstream_completion(state: MockState, body: Dict, auth: Optional[str]) -> Dict:
+    payload = {k: v for k, v in body.items() if k not in {"stream", "stream_options"}}
+    req = urllib.request.Request(
+        f"{state.upstream}/chat/completions",
+        data=json.dumps(payload).encode("utf-8"),
+        headers={
+            "Content-Type": "application/json",
+            "Authorization": auth or f"Bearer {os.environ.get('OPENAI_API_KEY', '')}",
+        },
+        method="POST",
+    )
+    with urllib.request.urlopen(req, timeout=600) as resp:
+        return json.loads(resp.read().decode("utf-8"))
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    server_version = "SanalMockOpenAI/1.0"
+    state: MockState = None
+
+    def log_message(self, fmt, *args):  # silencio salvo errores
+        pass
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+        raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, str(v))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _ratelimit_headers(self, total_tokens: int) -> Dict:
+        remaining = max(0, self.state.tpm_limit - total_tokens)
+        return {
+            "x-ratelimit-limit-tokens": self.state.tpm_limit,
+            "x-ratelimit-remaining-tokens": remaining,
+            "x-ratelimit-reset-tokens": "1s",
+        }
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            models = ["gpt-4o", "gpt-4o-mini", "gpt-4-turbo", "gpt-3.5-turbo"]
+            self._send_json(200, {"object": "list", "data": [{"id": m, "object": "model"} for m in models]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        state = self.state
+
+        if state.should_fail():
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}},
+                {"Retry-After": state.retry_after, **self._ratelimit_headers(state.tpm_limit)},
+            )
+            return
+
+        key = request_key(body)
+        if state.mode == "replay":
+            completion = state.fixtures.get(key)
+            if completion is None:
+                self._send_json(404, {"error": {"message": f"fixture no encontrado para {key[:12]}"}})
+                return
+        elif state.mode == "record":
+            try:
+                completion = upstream_completion(state, body, self.headers.get("Authorization"))
+            except urllib.error.HTTPError as e:
+                self._send_json(e.code, json.loads(e.read() or b"{}"))
+                return
+            state.record(key, body, completion)
+        else:
+            completion = synthetic_completion(state, body)
+
+        if state.mode != "record":
+            time.sleep(state.latency)
+        headers = self._ratelimit_headers(completion.get("usage", {}).get("total_tokens", 0))
+        if body.get("stream"):
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            self._stream(completion, include_usage, headers)
+        else:
+            self._send_json(200, completion, headers)
+
+    def _stream(self, completion: Dict, include_usage: bool, headers: Dict):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        for k, v in headers.items():
+            self.send_header(k, str(v))
+        self.end_headers()
+
+        base = {
+            "id": completion["id"],
+            "object": "chat.completion.chunk",
+            "created": completion["created"],
+            "model": completion["model"],
+        }
+
+        def emit(choices, usage=None):
+            chunk = {**base, "choices": choices}
+            if usage is not None:
+                chunk["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        choice = completion["choices"][0]
+        emit([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        words = (choice["message"].get("content") or "").split(" ")
+        delay = 1.0 / self.state.tps if self.state.tps > 0 else 0
+        for i, word in enumerate(words):
+            emit([{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}])
+            if delay:
+                time.sleep(delay)
+        emit([{"index": 0, "delta": {}, "finish_reason": choice.get("finish_reason", "stop")}])
+        if include_usage:
+            emit([], completion.get("usage"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def build_server(args) -> ThreadingHTTPServer:
+    handler = type("BoundMockHandler", (MockHandler,), {"state": MockState(args)})
+    return ThreadingHTTPServer((args.host, args.port), handler)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor OpenAI simulado para pruebas y benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--mode", choices=["synthetic", "record", "replay"], default="synthetic")
+    parser.add_argument("--fixtures", default=os.path.join(".cache", "openai_fixtures.jsonl"),
+                        help="Fichero JSONL de sesiones grabadas (record/replay)")
+    parser.add_argument("--upstream", default="https://api.openai.com/v1", help="API real para el modo record")
+    parser.add_argument("--latency", type=float, default=0.3, help="Segundos hasta el primer token")
+    parser.add_argument("--tps", type=float, default=80.0, help="Tokens por segundo en streaming (0 = sin pausa)")
+    parser.add_argument("--completion-tokens", type=int, default=400, help="Tokens de las respuestas sintéticas")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probabilidad de responder 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Valor de la cabecera Retry-After en los 429")
+    parser.add_argument("--tpm-limit", type=int, default=100000, help="Límite anunciado en las cabeceras x-ratelimit")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.mode in {"record", "replay"}:
+        os.makedirs(os.path.dirname(os.path.abspath(args.fixtures)), exist_ok=True)
+    server = build_server(args)
+    print(f"Servidor simulado ({args.mode}) en http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Selección adaptativa de modelo según latencia observada, tamaño del prompt y cuota.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from config import (
+    AVAILABLE_MODELS,
+    DEFAULT_MODEL,
+    MODEL_SELECTION_RULES,
+    LATENCY_TARGETS_S,
+    ROUTER_WINDOW,
+    ROUTER_MIN_SAMPLES,
+)
+
+
+logger = logging.getLogger("sanal.router")
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+class ModelRouter:
+    """
+    Elige el modelo más barato que cumple la latencia objetivo del contexto.
+
+    Mantiene, por modelo, una ventana de las últimas `window` llamadas
+    (latencia y tokens/s) y el instante hasta el que está limitado por un 429.
+    Cada decisión se registra en `decisions` y en el logger `sanal.router`.
+    """
+
+    def __init__(self, window: int = ROUTER_WINDOW, min_samples: int = ROUTER_MIN_SAMPLES):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[Tuple[float, Optional[float]]]] = {}
+        self._throttled_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.decisions: Deque[Dict] = deque(maxlen=200)
+
+    # --- observaciones ---
+
+    def observe(self, model: str, latency_s: float, completion_tokens: Optional[int] = None):
+        """Registra la latencia (y tokens/s si se conocen) de una llamada terminada."""
+        tps = completion_tokens / latency_s if completion_tokens and latency_s > 0 else None
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self.window)).append((latency_s, tps))
+
+    def mark_throttled(self, model: str, seconds: float):
+        """Marca un modelo como limitado (429) durante `seconds` segundos."""
+        with self._lock:
+            until = time.monotonic() + max(0.0, seconds)
+            self._throttled_until[model] = max(self._throttled_until.get(model, 0.0), until)
+
+    def is_throttled(self, model: str) -> bool:
+        with self._lock:
+            return time.monotonic() < self._throttled_until.get(model, 0.0)
+
+    def model_stats(self, model: str) -> Dict:
+        with self._lock:
+            samples = list(self._samples.get(model, ()))
+        latencies = sorted(lat for lat, _ in samples)
+        rates = [tps for _, tps in samples if tps]
+        return {
+            "n": len(samples),
+            "p50_s": _percentile(latencies, 0.5) if latencies else None,
+            "p95_s": _percentile(latencies, 0.95) if latencies else None,
+            "tokens_per_s": sum(rates) / len(rates) if rates else None,
+        }
+
+    # --- decisión ---
+
+    @staticmethod
+    def _required_quality(context: str, complexity: float) -> int:
+        base = MODEL_SELECTION_RULES.get(context, DEFAULT_MODEL)
+        required = AVAILABLE_MODELS.get(base, AVAILABLE_MODELS[DEFAULT_MODEL])["quality"]
+        # Mismos umbrales que la selección estática original
+        if complexity > 0.8:
+            required = max(required, AVAILABLE_MODELS["gpt-4-turbo"]["quality"])
+        elif complexity < 0.3:
+            required = min(required, AVAILABLE_MODELS["gpt-3.5-turbo"]["quality"])
+        return required
+
+    def _meets_target(self, model: str, target_s: float) -> Tuple[bool, Dict]:
+        stats = self.model_stats(model)
+        # Sin muestras suficientes se da el beneficio de la duda
+        if stats["n"] < self.min_samples:
+            return True, stats
+        return stats["p95_s"] <= target_s, stats
+
+    def route(
+        self,
+        context: str = "chat",
+        complexity: float = 0.5,
+        prompt_tokens: int = 0,
+        headroom: Optional[int] = None,
+        needs_vision: bool = False,
+    ) -> str:
+        """
+        Devuelve el modelo para una llamada.
+
+        Args:
+            context: Tipo de tarea ('chat', 'analysis', 'generation', 'vision', 'simple')
+            complexity: Nivel de complejidad (0.0-1.0)
+            prompt_tokens: Tokens estimados de entrada (descarta modelos sin ventana suficiente)
+            headroom: Tokens libres en el limitador; si no cubre el prompt, se
+                trata como cuota agotada y se pasa directamente al respaldo
+            needs_vision: Los mensajes llevan imágenes; solo valen modelos con visión
+
+        Returns:
+            Nombre del modelo elegido
+        """
+        target_s = LATENCY_TARGETS_S.get(context, LATENCY_TARGETS_S["chat"])
+        required = self._required_quality(context, complexity)
+        needs_vision = needs_vision or context == "vision"
+        fitting = [
+            name for name, info in AVAILABLE_MODELS.items()
+            if info.get("context_window", 0) >= prompt_tokens
+            and (not needs_vision or info.get("vision"))
+        ]
+        candidates = sorted(
+            (m for m in fitting if AVAILABLE_MODELS[m]["quality"] >= required),
+            key=lambda m: AVAILABLE_MODELS[m]["cost_rank"],
+        )
+        quota_pressure = headroom is not None and headroom < prompt_tokens
+
+        chosen, reason, stats = None, "", {}
+        if not quota_pressure:
+            for model in candidates:
+                if self.is_throttled(model):
+                    continue
+                ok, stats = self._meets_target(model, target_s)
+                if ok:
+                    chosen, reason = model, "más barato dentro del objetivo de latencia"
+                    break
+
+        if chosen is None:
+            # Respaldo: el modelo no limitado más rápido observado, aunque sea de menor calidad
+            available = [m for m in fitting if not self.is_throttled(m)] or fitting
+
+            def expected_p95(model: str) -> float:
+                stats = self.model_stats(model)
+                # Sin muestras suficientes se asume que cumple justo el objetivo
+                return stats["p95_s"] if stats["n"] >= self.min_samples else target_s
+
+            ranked = sorted(available, key=lambda m: (expected_p95(m), -AVAILABLE_MODELS[m]["quality"]))
+            chosen = ranked[0] if ranked else MODEL_SELECTION_RULES.get(context, DEFAULT_MODEL)
+            stats = self.model_stats(chosen)
+            reason = "respaldo por cuota agotada" if quota_pressure else "respaldo: candidatos limitados o lentos"
+
+        decision = {
+            "ts": time.time(),
+            "context": context,
+            "complexity": complexity,
+            "prompt_tokens": prompt_tokens,
+            "headroom": headroom,
+            "target_s": target_s,
+            "model": chosen,
+            "reason": reason,
+            "p95_s": stats.get("p95_s"),
+            "samples": stats.get("n", 0),
+        }
+        self.decisions.append(decision)
+        logger.info(
+            "router context=%s complexity=%.2f prompt=%d -> %s (%s, p95=%s, n=%s)",
+            context, complexity, prompt_tokens, chosen, reason, decision["p95_s"], decision["samples"],
+        )
+        return chosen
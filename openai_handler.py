@@ -4,88 +4,281 @@ Sin límites artificiales de palabras ni bandas de notas.
 """
 
 import os
+import sys
 import base64
-from typing import Optional, List, Dict, Tuple
+import hashlib
+import random
+from collections import OrderedDict
+from typing import Optional, List, Dict, Iterator, Tuple
 from dotenv import load_dotenv
-from openai import OpenAI
 from text_humanizer import humanize_text_light, sanitize_meta_discourse
-from prompts import DR_SANAL_SYSTEM_PROMPT
-from config import MODEL_SELECTION_RULES, DEFAULT_MODEL, AVAILABLE_MODELS
-import tiktoken
+from prompts import DR_SANAL_SYSTEM_PROMPT, get_system_prompt
+from config import (
+    AVAILABLE_MODELS, PHASE2_CONCURRENCY,
+    RESPONSE_CACHE_ENABLED, CACHE_DB_PATH, RESPONSE_CACHE_TTL_S, RESPONSE_CACHE_MAX_MB,
+    MAX_SECTION_CONTINUATIONS, CONTINUATION_TAIL_TOKENS,
+    CONTINUATION_CONTEXT_TOKENS, OPENAI_BASE_URL, API_MAX_RETRIES, API_BACKOFF_BASE_S,
+    API_BACKOFF_MAX_S, HISTORY_SUMMARY_MAX_TOKENS,
+)
+from token_counter import (
+    count_tokens, count_message_tokens, truncate_text_to_tokens, tail_text_to_tokens,
+    encoding_name_for_model, get_encoding,
+)
+from rate_limiter import TokenRateLimiter
+from model_router import ModelRouter
+from cache_store import SQLiteCache, content_key
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv()
 
 
-def get_client():
+def _build_client():
+    from openai import OpenAI  # import diferido: el SDK tarda en cargar
+
     api_key = os.environ.get("OPENAI_API_KEY")
+    if OPENAI_BASE_URL:
+        # Servidor compatible (p. ej. mock_openai_server.py): la clave puede ser ficticia
+        return OpenAI(api_key=api_key or "sk-local", base_url=OPENAI_BASE_URL, max_retries=0)
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY no encontrada en el entorno")
-    return OpenAI(api_key=api_key)
+    # Los reintentos los gestiona _call_with_retries (con Retry-After y el limitador)
+    return OpenAI(api_key=api_key, max_retries=0)
 
 
-client = get_client()
+def _running_under_streamlit() -> bool:
+    if "streamlit" not in sys.modules:
+        return False
+    try:
+        from streamlit import runtime
+        return runtime.exists()
+    except Exception:
+        return False
+
+
+_client = None
+_client_lock = threading.Lock()
+_streamlit_client_getter = None
+
+
+def get_client():
+    """
+    Cliente de OpenAI creado en el primer uso, no al importar el módulo.
+
+    Bajo Streamlit se guarda con `st.cache_resource`, compartido por todas las
+    sesiones y reruns del proceso; fuera de Streamlit, en una variable de módulo.
+    """
+    global _client, _streamlit_client_getter
+    if _running_under_streamlit():
+        if _streamlit_client_getter is None:
+            import streamlit as st
+            _streamlit_client_getter = st.cache_resource(show_spinner=False)(_build_client)
+        return _streamlit_client_getter()
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_client()
+    return _client
+
 
 # === Token & Rate Limiting Utilities ===
 
-def _enc():
-    return tiktoken.get_encoding("cl100k_base")
+def estimate_tokens(text: str, model: Optional[str] = None) -> int:
+    return count_tokens(text, model)
 
 
-def estimate_tokens(text: str) -> int:
-    try:
-        return len(_enc().encode(text or ""))
-    except Exception:
-        return len(text or "") // 4
+def estimate_message_tokens(messages: List[Dict], model: Optional[str] = None) -> int:
+    return count_message_tokens(messages, model)
 
 
-def estimate_message_tokens(messages: List[Dict]) -> int:
-    total = 0
-    for m in messages:
-        content = m.get("content", "")
-        if isinstance(content, list):
-            joined = "\n".join(part.get("text", "") for part in content if isinstance(part, dict) and part.get("type") == "text")
-            total += estimate_tokens(joined)
-        else:
-            total += estimate_tokens(str(content))
-    return total
+rate_limiter = TokenRateLimiter()
+router = ModelRouter()
 
 
-def truncate_text_to_tokens(text: str, max_tokens: int) -> str:
-    enc = _enc()
-    ids = enc.encode(text or "")
-    if len(ids) <= max_tokens:
-        return text
-    return enc.decode(ids[:max_tokens])
+# === Reintentos ===
 
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
 
-class TokenRateLimiter:
-    def __init__(self, tpm_limit: int = None):
-        self.tpm_limit = tpm_limit or int(os.getenv("OPENAI_TPM_LIMIT", "100000"))
-        self.window_tokens: List[Tuple[float, int]] = []
+retry_stats: Dict[str, Dict[str, float]] = {}
+_retry_stats_lock = threading.Lock()
 
-    def allow(self, planned_tokens: int):
-        now = time.time()
-        # Purge entries older than 60s
-        self.window_tokens = [(ts, tok) for ts, tok in self.window_tokens if now - ts < 60]
-        used = sum(tok for _, tok in self.window_tokens)
-        if used + planned_tokens <= self.tpm_limit:
-            self.window_tokens.append((now, planned_tokens))
-            return
-        # Sleep until enough capacity
-        deficit = used + planned_tokens - self.tpm_limit
-        sleep_s = max(1.0, (deficit / max(1, self.tpm_limit)) * 60)
-        time.sleep(sleep_s)
-        # After sleeping, register
-        now2 = time.time()
-        self.window_tokens = [(ts, tok) for ts, tok in self.window_tokens if now2 - ts < 60]
-        self.window_tokens.append((now2, planned_tokens))
 
+def _record_retry_stat(phase: str, **deltas):
+    with _retry_stats_lock:
+        entry = retry_stats.setdefault(phase, {"calls": 0, "retries": 0, "failures": 0, "wait_s": 0.0})
+        for k, v in deltas.items():
+            entry[k] += v
 
-rate_limiter = TokenRateLimiter()
+
+def get_retry_stats() -> Dict[str, Dict[str, float]]:
+    """Copia de los contadores de reintentos por fase (calls, retries, failures, wait_s)."""
+    with _retry_stats_lock:
+        return {phase: dict(entry) for phase, entry in retry_stats.items()}
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def _is_retryable(error: Exception) -> bool:
+    from openai import APIStatusError, APIConnectionError, APITimeoutError
+
+    if isinstance(error, (APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code in RETRYABLE_STATUS
+
+
+def _call_with_retries(phase: str, **request):
+    """
+    Ejecuta `chat.completions.create` con reintentos y backoff exponencial con jitter.
+
+    Respeta Retry-After en los 429/5xx, bloquea `rate_limiter` mientras tanto y
+    le pasa las cabeceras x-ratelimit-* de cada respuesta. Los contadores se
+    acumulan en `retry_stats[phase]`.
+
+    Returns:
+        (respuesta, instante `perf_counter` en que empezó el intento que tuvo
+        éxito), para medir la latencia sin contar las esperas entre reintentos
+    """
+    _record_retry_stat(phase, calls=1)
+    attempt = 0
+    while True:
+        attempt_t0 = time.perf_counter()
+        try:
+            raw = get_client().chat.completions.with_raw_response.create(**request)
+            rate_limiter.update_from_headers(raw.headers)
+            return raw.parse(), attempt_t0
+        except Exception as e:
+            if not _is_retryable(e) or attempt >= API_MAX_RETRIES:
+                _record_retry_stat(phase, failures=1)
+                raise
+            response = getattr(e, "response", None)
+            if response is not None:
+                rate_limiter.update_from_headers(response.headers)
+            backoff = random.uniform(0, min(API_BACKOFF_MAX_S, API_BACKOFF_BASE_S * (2 ** attempt)))
+            retry_after = _retry_after_seconds(e)
+            delay = max(retry_after, backoff) if retry_after is not None else backoff
+            if getattr(e, "status_code", None) == 429:
+                rate_limiter.penalize(delay)
+                router.mark_throttled(request.get("model"), delay)
+            _record_retry_stat(phase, retries=1, wait_s=delay)
+            time.sleep(delay)
+            attempt += 1
+
+
+_response_cache: Optional[SQLiteCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[SQLiteCache]:
+    """Caché de respuestas en disco; None si no está activada (SANAL_RESPONSE_CACHE=1)."""
+    global _response_cache
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = SQLiteCache(
+                CACHE_DB_PATH,
+                table="responses",
+                ttl_s=RESPONSE_CACHE_TTL_S,
+                max_bytes=int(RESPONSE_CACHE_MAX_MB * 1024 * 1024),
+            )
+    return _response_cache
+
+
+def _usage_dict(usage) -> Optional[Dict]:
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "total_tokens": usage.total_tokens,
+        # Tokens del prefijo servidos desde la caché de prompts del proveedor
+        "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+    }
+
+
+def _response_cache_key(model: str, messages: List[Dict], temperature: Optional[float], max_tokens: int, cacheable: bool) -> Optional[str]:
+    """
+    Clave de caché para la llamada, o None si no debe cachearse.
+
+    Solo se cachean las llamadas marcadas como `cacheable` (fase 0, fase 1 y
+    /nota): en chat y redacción cada respuesta debe ser distinta a propósito.
+    """
+    if not cacheable or get_response_cache() is None:
+        return None
+    return content_key({"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens})
+
+
+def _create_completion(
+    model: str,
+    messages: List[Dict],
+    temperature: Optional[float],
+    max_tokens: int,
+    phase: str = "chat",
+    cacheable: bool = False,
+) -> Dict:
+    """
+    Llamada a chat completions pasando por `rate_limiter` y la caché de respuestas.
+
+    Se reserva la entrada estimada más `max_tokens` y, al llegar la respuesta,
+    la reserva se ajusta a `usage.total_tokens` para devolver el margen no usado.
+
+    Returns:
+        Dict con content, finish_reason, usage y cached
+    """
+    cache_key = _response_cache_key(model, messages, temperature, max_tokens, cacheable)
+    if cache_key:
+        hit = get_response_cache().get_json(cache_key)
+        if hit is not None:
+            return {**hit, "cached": True}
+
+    prompt_tokens = estimate_message_tokens(messages, model)
+    reservation = rate_limiter.allow(prompt_tokens + max_tokens)
+    try:
+        kwargs = {"temperature": temperature} if temperature is not None else {}
+        resp, attempt_t0 = _call_with_retries(
+            phase,
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            **kwargs,
+        )
+    except Exception:
+        # Sin respuesta no hay salida que contar; se libera el margen reservado
+        rate_limiter.reconcile(reservation, prompt_tokens)
+        raise
+    usage = getattr(resp, "usage", None)
+    rate_limiter.reconcile(reservation, getattr(usage, "total_tokens", None))
+    router.observe(model, time.perf_counter() - attempt_t0, getattr(usage, "completion_tokens", None))
+
+    result = {
+        "content": resp.choices[0].message.content,
+        "finish_reason": resp.choices[0].finish_reason,
+        "usage": _usage_dict(usage),
+    }
+    if cache_key and result["content"]:
+        get_response_cache().put_json(cache_key, result)
+    return {**result, "cached": False}
 
 
-def build_attachments_summary(attachments: List[Dict], max_tokens: int = 3000) -> str:
+def _attachments_summary_text(attachments: List[Dict]) -> str:
     lines = ["ADJUNTOS DEL ESTUDIANTE (resumen):"]
     for i, att in enumerate(attachments or [], start=1):
         kind = att.get("kind", "?")
@@ -101,47 +294,133 @@ def build_attachments_summary(attachments: List[Dict], max_tokens: int = 3000) -
         else:
             content = f"[{i}] {name} ({kind}): {summary}"
         lines.append(content)
-    text = "\n\n".join(lines)
-    return truncate_text_to_tokens(text, max_tokens)
+    return "\n\n".join(lines)
 
 
-def looks_truncated(text: str) -> bool:
-    if not text or len(text) < 200:
-        return False
-    tail = text[-200:]
-    ends_ok = any(text.strip().endswith(p) for p in [".", "!", "?", ")", "]", "\""])
-    has_heading = any(h in tail.lower() for h in ["referencias", "bibliografía", "discusión", "resultados"])
-    mid_word_cut = tail.endswith(" ") and not ends_ok
-    return (not ends_ok) or mid_word_cut or has_heading
+class AttachmentDigest:
+    """
+    Resumen de adjuntos tokenizado una sola vez.
+
+    Guarda los ids de tokens del resumen completo; cada fase pide el prefijo
+    que cabe en su presupuesto sin volver a codificar, y los prefijos ya
+    decodificados se memorizan por presupuesto. Si la codificación no está
+    disponible se usa la misma estimación que `count_tokens` (len // 4).
+    """
+
+    def __init__(self, text: str, model: Optional[str] = None):
+        self.text = text
+        self.encoding_name = encoding_name_for_model(model)
+        self._enc = get_encoding(self.encoding_name)
+        self.ids = self._enc.encode(text) if self._enc is not None else None
+        self._prefixes: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        if self.ids is None:
+            return len(self.text) // 4
+        return len(self.ids)
+
+    def prefix(self, max_tokens: int) -> str:
+        """Texto del resumen recortado a `max_tokens` tokens."""
+        if max_tokens >= len(self):
+            return self.text
+        if self._enc is None:
+            return self.text[:max_tokens * 4]
+        with self._lock:
+            cached = self._prefixes.get(max_tokens)
+            if cached is None:
+                cached = self._enc.decode(self.ids[:max_tokens])
+                self._prefixes[max_tokens] = cached
+            return cached
+
+
+_digest_cache: "OrderedDict[tuple, AttachmentDigest]" = OrderedDict()
+_digest_cache_lock = threading.Lock()
+DIGEST_CACHE_SIZE = 8
+
+
+def get_attachment_digest(attachments: List[Dict], model: Optional[str] = None) -> AttachmentDigest:
+    """
+    Devuelve el digest de los adjuntos, reutilizándolo mientras no cambien.
+
+    La clave es el hash del texto del resumen, así que añadir, quitar o
+    reemplazar un adjunto en la sesión invalida el digest automáticamente.
+    """
+    text = _attachments_summary_text(attachments)
+    key = (encoding_name_for_model(model), hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest())
+    with _digest_cache_lock:
+        digest = _digest_cache.get(key)
+        if digest is not None:
+            _digest_cache.move_to_end(key)
+            return digest
+    digest = AttachmentDigest(text, model)
+    with _digest_cache_lock:
+        _digest_cache[key] = digest
+        while len(_digest_cache) > DIGEST_CACHE_SIZE:
+            _digest_cache.popitem(last=False)
+    return digest
+
+
+def _digest_for_model(attachments: List[Dict], model: Optional[str], digest: Optional[AttachmentDigest] = None) -> AttachmentDigest:
+    """Reutiliza `digest` si comparte codificación con `model`; si no, pide el del modelo."""
+    if digest is not None and digest.encoding_name == encoding_name_for_model(model):
+        return digest
+    return get_attachment_digest(attachments, model)
+
+
+def build_attachments_summary(
+    attachments: List[Dict],
+    max_tokens: int = 3000,
+    digest: Optional[AttachmentDigest] = None,
+    model: Optional[str] = None,
+) -> str:
+    digest = _digest_for_model(attachments, model, digest)
+    return digest.prefix(max_tokens)
 
 
 def select_model(
     context: str = "chat",
     complexity: float = 0.5,
-    force_model: Optional[str] = None
+    force_model: Optional[str] = None,
+    prompt_tokens: int = 0,
+    needs_vision: bool = False,
 ) -> str:
     """
     Selecciona el modelo GPT más apropiado según el contexto y complejidad.
+
+    La decisión la toma `router`: el modelo más barato con la calidad que
+    pide el contexto cuya latencia p95 observada cumple el objetivo, con
+    respaldo si está limitado (429) o no queda cuota.
     
     Args:
         context: Tipo de tarea ('chat', 'analysis', 'generation', 'vision', 'simple')
         complexity: Nivel de complejidad (0.0-1.0, donde 1.0 es máxima)
         force_model: Si se proporciona, ignora la selección automática
+        prompt_tokens: Tokens estimados de entrada
+        needs_vision: Los mensajes llevan imágenes (descarta modelos sin visión)
     
     Returns:
         Nombre del modelo a usar
     """
     if force_model and force_model in AVAILABLE_MODELS:
         return force_model
-    
-    base_model = MODEL_SELECTION_RULES.get(context, DEFAULT_MODEL)
-    
-    if complexity > 0.8:
-        return "gpt-4-turbo"
-    elif complexity < 0.3:
-        return "gpt-3.5-turbo"
-    
-    return base_model
+
+    return router.route(
+        context=context,
+        complexity=complexity,
+        prompt_tokens=prompt_tokens,
+        headroom=rate_limiter.headroom(),
+        needs_vision=needs_vision,
+    )
+
+
+def _has_images(messages: List[Dict]) -> bool:
+    """True si algún mensaje incluye partes `image_url`."""
+    return any(
+        isinstance(part, dict) and part.get("type") == "image_url"
+        for m in messages if isinstance(m.get("content"), list)
+        for part in m["content"]
+    )
 
 
 def build_context_block(attachments: List[Dict]) -> str:
@@ -170,6 +449,46 @@ def build_context_block(attachments: List[Dict]) -> str:
     return "\n\n".join(lines)
 
 
+def build_content_with_images(text_block: str, attachments: List[Dict]) -> List[Dict]:
+    """Prepara contenido multimodal para OpenAI (texto + imágenes base64)."""
+    content: List[Dict] = [{"type": "text", "text": text_block}]
+    for att in attachments:
+        if att.get("kind") == "image" and att.get("base64"):
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:{att.get('mime_type', 'image/jpeg')};base64,{att['base64']}",
+                    "detail": att.get("detail", "auto"),
+                }
+            })
+    return content
+
+
+ATTACHMENT_PREFIX_HEADER = "MATERIAL DE REFERENCIA DE LA CONVERSACIÓN (adjuntos del estudiante, válidos para todos los turnos):"
+
+
+def build_attachment_prefix(attachments: List[Dict]) -> List[Dict]:
+    """
+    Mensaje fijo con todos los adjuntos (texto + imágenes) para el inicio de la conversación.
+
+    Para los mismos adjuntos produce exactamente el mismo contenido, así que,
+    colocado justo después del prompt de sistema, forma un prefijo estable que
+    la caché de prompts del proveedor puede reutilizar turno a turno.
+    """
+    if not attachments:
+        return []
+    block = f"{ATTACHMENT_PREFIX_HEADER}\n\n{build_context_block(attachments)}"
+    return [{"role": "user", "content": build_content_with_images(block, attachments)}]
+
+
+def attachment_reference(attachments: List[Dict]) -> str:
+    """Referencia breve a los adjuntos ya enviados en el prefijo."""
+    if not attachments:
+        return ""
+    names = ", ".join(f"[{i}] {att.get('name', f'archivo_{i}')}" for i, att in enumerate(attachments, start=1))
+    return f"(Adjuntos disponibles al inicio de la conversación: {names})"
+
+
 def chat_with_sanal(
     messages: list,
     system_prompt: str,
@@ -178,6 +497,7 @@ def chat_with_sanal(
     context: str = "chat",
     complexity: float = 0.5,
     force_model: Optional[str] = None,
+    cacheable: bool = False,
 ) -> str:
     """
     Envía un mensaje a OpenAI con la personalidad del Dr. Sanal.
@@ -191,27 +511,218 @@ def chat_with_sanal(
         context: Tipo de tarea ('chat', 'analysis', 'generation', 'vision', 'simple')
         complexity: Nivel de complejidad (0.0-1.0)
         force_model: Fuerza un modelo específico
+        cacheable: Reutiliza respuestas idénticas de la caché de respuestas (si está activada)
     
     Returns:
         La respuesta del Dr. Sanal
     """
-    model = select_model(context=context, complexity=complexity, force_model=force_model)
+    model = select_model(
+        context=context,
+        complexity=complexity,
+        force_model=force_model,
+        prompt_tokens=estimate_message_tokens([{"content": system_prompt}, *messages]),
+        needs_vision=_has_images(messages),
+    )
     
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
+        response = _create_completion(
+            model,
+            [
                 {"role": "system", "content": system_prompt},
                 *messages
             ],
             temperature=temperature,
             max_tokens=max_tokens,
+            phase=context,
+            cacheable=cacheable,
         )
-        return response.choices[0].message.content
+        return response["content"]
     except Exception as e:
         return f"Error en la API: {str(e)}"
 
 
+def stream_chat_with_sanal(
+    messages: list,
+    system_prompt: str,
+    temperature: float = 0.7,
+    max_tokens: int = 3000,
+    context: str = "chat",
+    complexity: float = 0.5,
+    force_model: Optional[str] = None,
+    metrics: Optional[Dict] = None,
+    cacheable: bool = False,
+) -> Iterator[str]:
+    """
+    Variante en streaming de `chat_with_sanal`: produce los fragmentos de texto
+    a medida que llegan. Concatenarlos da la misma respuesta final.
+
+    Args:
+        (los mismos que `chat_with_sanal`)
+        metrics: Si se pasa, se rellena con model, ttft_s (tiempo hasta el
+            primer token), total_s y usage
+
+    Yields:
+        Fragmentos de la respuesta del Dr. Sanal
+    """
+    full_messages = [{"role": "system", "content": system_prompt}, *messages]
+    model = select_model(
+        context=context,
+        complexity=complexity,
+        force_model=force_model,
+        prompt_tokens=estimate_message_tokens(full_messages),
+        needs_vision=_has_images(full_messages),
+    )
+    stats = metrics if metrics is not None else {}
+    stats.update({"model": model, "ttft_s": None, "total_s": None, "usage": None, "cached": False})
+    t0 = time.perf_counter()
+
+    cache_key = _response_cache_key(model, full_messages, temperature, max_tokens, cacheable)
+    if cache_key:
+        hit = get_response_cache().get_json(cache_key)
+        if hit is not None:
+            stats.update({"ttft_s": time.perf_counter() - t0, "usage": hit.get("usage"), "cached": True})
+            yield hit["content"]
+            stats["total_s"] = time.perf_counter() - t0
+            return
+
+    prompt_tokens = estimate_message_tokens(full_messages, model)
+    reservation = rate_limiter.allow(prompt_tokens + max_tokens)
+    parts: List[str] = []
+    usage = None
+    finish_reason = None
+    attempt_t0 = None
+    try:
+        stream, attempt_t0 = _call_with_retries(
+            f"stream_{context}",
+            model=model,
+            messages=full_messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if stats["ttft_s"] is None:
+                    stats["ttft_s"] = time.perf_counter() - t0
+                parts.append(delta)
+                yield delta
+        if cache_key and parts:
+            get_response_cache().put_json(cache_key, {
+                "content": "".join(parts),
+                "finish_reason": finish_reason,
+                "usage": _usage_dict(usage),
+            })
+    except Exception as e:
+        yield f"Error en la API: {str(e)}"
+    finally:
+        stats["total_s"] = time.perf_counter() - t0
+        completion_tokens = usage.completion_tokens if usage is not None else count_tokens("".join(parts), model)
+        if usage is not None:
+            stats["usage"] = _usage_dict(usage)
+            rate_limiter.reconcile(reservation, usage.total_tokens)
+        else:
+            rate_limiter.reconcile(reservation, prompt_tokens + completion_tokens)
+        if parts and attempt_t0 is not None:
+            router.observe(model, time.perf_counter() - attempt_t0, completion_tokens)
+
+
+def summarize_conversation(previous_summary: str, messages: List[Dict], max_tokens: int = HISTORY_SUMMARY_MAX_TOKENS) -> str:
+    """
+    Integra `messages` en el resumen acumulado de la conversación.
+
+    Se usa para plegar los turnos antiguos que ya no caben en el presupuesto
+    del historial; el resumen anterior se actualiza, no se rehace desde cero.
+    """
+    transcript = "\n\n".join(
+        f"{'ESTUDIANTE' if m.get('role') == 'user' else 'DR. SANAL'}: {m.get('content', '')}"
+        for m in messages
+        if isinstance(m.get("content"), str)
+    )
+    user_prompt = f"""
+RESUMEN ACTUAL DE LA CONVERSACIÓN:
+{previous_summary or "(vacío)"}
+
+NUEVOS TURNOS A INTEGRAR:
+{transcript}
+
+Actualiza el resumen en pocas líneas: temas tratados, decisiones, datos y
+correcciones que el Dr. Sanal ya ha dado y peticiones pendientes del estudiante.
+Devuelve solo el resumen, sin comentarios.
+"""
+    messages_api = [
+        {"role": "system", "content": "Resumes conversaciones académicas de forma fiel y compacta."},
+        {"role": "user", "content": user_prompt},
+    ]
+    resp = _create_completion("gpt-4o-mini", messages_api, temperature=0.2, max_tokens=max_tokens, phase="history_summary")
+    return (resp["content"] or "").strip()
+
+
+DEFAULT_GRADING_QUESTION = "Califica el trabajo adjunto con nota 0-10 REAL basada en criterios UOC y justifica APA/metodología/coherencia."
+
+
+def build_grading_request(
+    attachments: List[Dict],
+    question: Optional[str] = None,
+    language_choice: Optional[str] = None,
+    model: Optional[str] = None,
+    max_tokens: int = 3000,
+) -> Dict:
+    """
+    Cuerpo de chat completions equivalente a /nota para un conjunto de adjuntos.
+
+    Returns:
+        Dict con model, messages, temperature y max_tokens
+    """
+    control = f"Idioma: {language_choice}." if language_choice and language_choice != "Automático" else ""
+    text_block = f"{control}\n\nInstrucción: {question or DEFAULT_GRADING_QUESTION}"
+    messages = [
+        {"role": "system", "content": get_system_prompt("analysis")},
+        *build_attachment_prefix(attachments),
+        {"role": "user", "content": f"{attachment_reference(attachments)}\n\n{text_block}"},
+    ]
+    model = model or select_model(
+        context="analysis",
+        complexity=0.7,
+        prompt_tokens=estimate_message_tokens(messages),
+        needs_vision=_has_images(messages),
+    )
+    return {"model": model, "messages": messages, "temperature": 0.7, "max_tokens": max_tokens}
+
+
+def grade_attachments(
+    attachments: List[Dict],
+    question: Optional[str] = None,
+    language_choice: Optional[str] = None,
+    force_model: Optional[str] = None,
+) -> Dict:
+    """
+    Evalúa un conjunto de adjuntos como /nota, sin interfaz.
+
+    A diferencia de `chat_with_sanal`, los errores de la API se propagan para
+    que el llamador (p. ej. el procesamiento por lotes) pueda registrarlos.
+
+    Returns:
+        Dict con model, content, finish_reason, usage y cached
+    """
+    request = build_grading_request(attachments, question, language_choice, model=force_model)
+    result = _create_completion(
+        request["model"],
+        request["messages"],
+        temperature=request["temperature"],
+        max_tokens=request["max_tokens"],
+        phase="batch_grading",
+        cacheable=True,
+    )
+    return {"model": request["model"], **result}
+
+
 def analyze_image_with_sanal(
     image_path: str,
     system_prompt: str,
@@ -247,9 +758,9 @@ def analyze_image_with_sanal(
         }
         media_type = media_type_map.get(ext, "image/jpeg")
         
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
+        response = _create_completion(
+            model,
+            [
                 {"role": "system", "content": system_prompt},
                 {
                     "role": "user",
@@ -267,9 +778,11 @@ def analyze_image_with_sanal(
                     ]
                 }
             ],
+            temperature=None,
             max_tokens=3000,
+            phase="vision",
         )
-        return response.choices[0].message.content
+        return response["content"]
     except Exception as e:
         return f"Error analizando imagen: {str(e)}"
 
@@ -294,14 +807,19 @@ def extract_text_from_pdf_with_sanal(
     Returns:
         Análisis del PDF
     """
-    model = select_model(context="analysis", complexity=complexity, force_model=force_model)
+    model = select_model(
+        context="analysis",
+        complexity=complexity,
+        force_model=force_model,
+        prompt_tokens=estimate_tokens(pdf_text),
+    )
     
     try:
         query = custom_query or "Analiza este trabajo académico. Incluye: errores APA 7, fortalezas metodológicas, debilidades, sugerencias de mejora. Proporciona una nota 0-10 REAL basada en criterios UOC."
         
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
+        response = _create_completion(
+            model,
+            [
                 {"role": "system", "content": system_prompt},
                 {
                     "role": "user",
@@ -310,8 +828,9 @@ def extract_text_from_pdf_with_sanal(
             ],
             temperature=0.7,
             max_tokens=3000,
+            phase="pdf",
         )
-        return response.choices[0].message.content
+        return response["content"]
     except Exception as e:
         return f"Error analizando PDF: {str(e)}"
 
@@ -325,7 +844,7 @@ def _language_instruction(language_hint: Optional[str]) -> str:
     return "Responde en el idioma del estudiante."
 
 
-def phase0_analyze_assignment(topic: str, requirements: str, attachments: List[Dict]) -> str:
+def phase0_analyze_assignment(topic: str, requirements: str, attachments: List[Dict], digest: Optional[AttachmentDigest] = None) -> str:
     """
     FASE 0 (NUEVA): Analiza qué pide la consigna Y detecta el patrón humano del estudiante.
     - Detecta el tipo de trabajo (teórico, reflexivo, investigación, etc.)
@@ -334,7 +853,7 @@ def phase0_analyze_assignment(topic: str, requirements: str, attachments: List[D
     - CLAVE: Analiza el trabajo humano como referencia de ESTILO y PROFUNDIDAD
     """
     model = "gpt-4o-mini"
-    att_summary = build_attachments_summary(attachments, max_tokens=2500)
+    att_summary = build_attachments_summary(attachments, max_tokens=2500, digest=digest, model=model)
     
     user_prompt = f"""
 ANÁLISIS DE CONSIGNA Y PATRÓN HUMANO - FASE 0
@@ -404,23 +923,15 @@ Devuelve tu análisis en formato claro, punto por punto:
         {"role": "system", "content": DR_SANAL_SYSTEM_PROMPT},
         {"role": "user", "content": user_prompt},
     ]
-    planned = estimate_message_tokens(messages) + 1500
-    rate_limiter.allow(planned)
-    
-    resp = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=0.5,
-        max_tokens=1500,
-    )
-    analysis = resp.choices[0].message.content
+    resp = _create_completion(model, messages, temperature=0.5, max_tokens=1500, phase="phase0", cacheable=True)
+    analysis = resp["content"]
     return sanitize_meta_discourse(analysis)
 
 
-def phase1_analyze_and_outline(topic: str, requirements: str, attachments: List[Dict], language_hint: Optional[str], assignment_analysis: str) -> str:
+def phase1_analyze_and_outline(topic: str, requirements: str, attachments: List[Dict], language_hint: Optional[str], assignment_analysis: str, digest: Optional[AttachmentDigest] = None) -> str:
     """Fase 1: esquema que RESPETA la consigna y el patrón humano. PROHIBIDO redactar."""
     model = "gpt-4o-mini"
-    att_summary = build_attachments_summary(attachments, max_tokens=1800)
+    att_summary = build_attachments_summary(attachments, max_tokens=1800, digest=digest, model=model)
     user_prompt = f"""
 CONSIGNA ANALIZADA (Fase 0):
 {assignment_analysis}
@@ -452,18 +963,15 @@ INSTRUCCIÓN CRÍTICA PARA ESQUEMA:
         {"role": "system", "content": DR_SANAL_SYSTEM_PROMPT},
         {"role": "user", "content": user_prompt},
     ]
-    planned = estimate_message_tokens(messages) + 1200
-    rate_limiter.allow(planned)
-    resp = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=0.4,
-        max_tokens=1200,
-    )
-    schema = resp.choices[0].message.content
+    resp = _create_completion(model, messages, temperature=0.4, max_tokens=1200, phase="phase1", cacheable=True)
+    schema = resp["content"]
     return sanitize_meta_discourse(schema)
 
 
+# Secciones de la fase 2, en el orden en que se montan en el documento
+PHASE2_SECTIONS = ["Introducción", "Método", "Resultados", "Discusión", "Conclusiones"]
+
+
 def _section_instruction(section: str) -> str:
     base = {
         "Introducción": "Presenta el problema, contexto, objetivos y relevancia académica.",
@@ -475,14 +983,27 @@ def _section_instruction(section: str) -> str:
     return base.get(section, "Redacta la sección solicitada con rigor académico.")
 
 
-def phase2_write_sections(schema: str, attachments: List[Dict], language_hint: Optional[str], assignment_analysis: str) -> Dict[str, str]:
-    """Fase 2: redacción por sección, respetando consigna y patrón humano."""
-    sections = ["Introducción", "Método", "Resultados", "Discusión", "Conclusiones"]
-    model = "gpt-4o"
-    att_summary = build_attachments_summary(attachments, max_tokens=2400)
-    results: Dict[str, str] = {}
-    for sec in sections:
-        user_prompt = f"""
+def _write_section(
+    sec: str,
+    schema: str,
+    digest: AttachmentDigest,
+    language_hint: Optional[str],
+    assignment_analysis: str,
+    model: str,
+    max_continuations: int = MAX_SECTION_CONTINUATIONS,
+) -> Tuple[str, int]:
+    """
+    Redacta una sección completa.
+
+    Si la API corta la respuesta (`finish_reason == "length"`) se pide una
+    continuación enviando solo la cola del texto ya escrito y un extracto
+    breve de los adjuntos, como mucho `max_continuations` veces.
+
+    Returns:
+        (texto de la sección, número de continuaciones usadas)
+    """
+    att_summary = digest.prefix(2400)
+    user_prompt = f"""
 RESTRICCIONES Y PATRÓN (CRÍTICO):
 {assignment_analysis}
 
@@ -507,50 +1028,84 @@ Si no hay datos en los PDFs: usa análisis cualitativo o plantea escenarios EXPL
 - {_language_instruction(language_hint)}
 - No incluyas otras secciones.
 """
-        messages = [
-            {"role": "system", "content": DR_SANAL_SYSTEM_PROMPT},
-            {"role": "user", "content": f"{att_summary}\n\n{user_prompt}"},
-        ]
-        planned = estimate_message_tokens(messages) + 3600
-        rate_limiter.allow(planned)
-        resp = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=0.7,
-            max_tokens=3600,
-        )
-        text = resp.choices[0].message.content
-        text = humanize_text_light(sanitize_meta_discourse(text))
-        # Continuación automática si quedó cortado
-        while looks_truncated(text):
-            cont_prompt = f"""
+    messages = [
+        {"role": "system", "content": DR_SANAL_SYSTEM_PROMPT},
+        {"role": "user", "content": f"{att_summary}\n\n{user_prompt}"},
+    ]
+    resp = _create_completion(model, messages, temperature=0.7, max_tokens=3600, phase="phase2")
+    text = humanize_text_light(sanitize_meta_discourse(resp["content"]))
+    finish_reason = resp["finish_reason"]
+    continuations = 0
+    # Continuación acotada: cola del texto + extracto de adjuntos, con tope de intentos
+    while finish_reason == "length" and continuations < max_continuations:
+        tail = tail_text_to_tokens(text, CONTINUATION_TAIL_TOKENS, model)
+        cont_prompt = f"""
 Continúa EXACTAMENTE la sección {sec} desde donde se quedó.
 No repitas contenido. Mantén el tono y estructura.
 """
-            cont_messages = [
-                {"role": "system", "content": DR_SANAL_SYSTEM_PROMPT},
-                {"role": "user", "content": f"{att_summary}\n\n{cont_prompt}\n\nTEXTO ACTUAL:\n{text}"},
-            ]
-            planned2 = estimate_message_tokens(cont_messages) + 1800
-            rate_limiter.allow(planned2)
-            resp2 = client.chat.completions.create(
-                model=model,
-                messages=cont_messages,
-                temperature=0.7,
-                max_tokens=1800,
-            )
-            add = resp2.choices[0].message.content
-            add = humanize_text_light(sanitize_meta_discourse(add))
-            text = text + "\n" + add
-        results[sec] = text
-    return results
+        cont_messages = [
+            {"role": "system", "content": DR_SANAL_SYSTEM_PROMPT},
+            {"role": "user", "content": f"{digest.prefix(CONTINUATION_CONTEXT_TOKENS)}\n\n{cont_prompt}\n\nFINAL DEL TEXTO ACTUAL:\n{tail}"},
+        ]
+        resp2 = _create_completion(model, cont_messages, temperature=0.7, max_tokens=1800, phase="phase2_continuation")
+        add = humanize_text_light(sanitize_meta_discourse(resp2["content"]))
+        text = text + "\n" + add
+        finish_reason = resp2["finish_reason"]
+        continuations += 1
+    return text, continuations
+
+
+def phase2_write_sections(
+    schema: str,
+    attachments: List[Dict],
+    language_hint: Optional[str],
+    assignment_analysis: str,
+    concurrency: Optional[int] = None,
+    section_stats: Optional[Dict[str, Dict]] = None,
+    digest: Optional[AttachmentDigest] = None,
+) -> Dict[str, str]:
+    """
+    Fase 2: redacción por sección, respetando consigna y patrón humano.
 
+    Cada sección depende solo del esquema, del análisis de consigna y de los
+    adjuntos, así que se redactan en paralelo. Cada petición pasa igualmente
+    por `rate_limiter`, que sigue marcando el presupuesto de tokens por minuto.
 
-def phase3_coherence_pass(full_text: str, attachments: List[Dict], language_hint: Optional[str], assignment_analysis: str) -> str:
+    Args:
+        concurrency: Máximo de secciones simultáneas (por defecto
+            `PHASE2_CONCURRENCY`; 1 equivale al modo secuencial)
+        section_stats: Si se pasa, se rellena con
+            {sección: {"seconds": ..., "continuations": ...}}
+
+    Returns:
+        Dict {sección: texto} en el orden canónico de secciones
+    """
+    sections = PHASE2_SECTIONS
+    model = "gpt-4o"
+    digest = _digest_for_model(attachments, model, digest)
+    workers = max(1, min(concurrency or PHASE2_CONCURRENCY, len(sections)))
+    stats = section_stats if section_stats is not None else {}
+
+    def timed(sec: str) -> str:
+        t0 = time.perf_counter()
+        text, continuations = _write_section(sec, schema, digest, language_hint, assignment_analysis, model)
+        stats[sec] = {"seconds": round(time.perf_counter() - t0, 3), "continuations": continuations}
+        return text
+
+    if workers == 1:
+        return {sec: timed(sec) for sec in sections}
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="phase2") as pool:
+        futures = {sec: pool.submit(timed, sec) for sec in sections}
+        # Se recogen en el orden canónico; un fallo se propaga como en modo secuencial
+        return {sec: futures[sec].result() for sec in sections}
+
+
+def phase3_coherence_pass(full_text: str, attachments: List[Dict], language_hint: Optional[str], assignment_analysis: str, digest: Optional[AttachmentDigest] = None) -> str:
     """Fase 3: revisión ligera, SIN agregar elementos artificiales. Solo suavizar coherencia."""
     model = "gpt-4o-mini"
-    att_summary = build_attachments_summary(attachments, max_tokens=1000)
-    context_text = truncate_text_to_tokens(full_text, 6000)
+    att_summary = build_attachments_summary(attachments, max_tokens=1000, digest=digest, model=model)
+    context_text = truncate_text_to_tokens(full_text, 6000, model)
     user_prompt = f"""
 RESTRICCIONES FINALES (CRÍTICO):
 {assignment_analysis}
@@ -577,15 +1132,8 @@ Devuelve el TEXTO MEJORADO directamente, sin comentarios.
         {"role": "system", "content": DR_SANAL_SYSTEM_PROMPT},
         {"role": "user", "content": f"{att_summary}\n\n{user_prompt}\n\nTEXTO:\n{context_text}"},
     ]
-    planned = estimate_message_tokens(messages) + 1000
-    rate_limiter.allow(planned)
-    resp = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=0.3,
-        max_tokens=1000,
-    )
-    improved = resp.choices[0].message.content
+    resp = _create_completion(model, messages, temperature=0.3, max_tokens=1000, phase="phase3")
+    improved = resp["content"]
     return humanize_text_light(sanitize_meta_discourse(improved))
 
 
@@ -594,27 +1142,33 @@ def generate_academic_work_phased(
     requirements: str,
     attachments: List[Dict],
     language_hint: Optional[str] = None,
+    section_stats: Optional[Dict[str, Dict]] = None,
 ) -> str:
     """Orquesta las 4 fases: análisis de consigna + esquema + secciones + coherencia."""
     try:
+        # Resumen de adjuntos tokenizado una vez; cada fase toma su prefijo.
+        # Las fases usan gpt-4o y gpt-4o-mini (misma codificación); una fase con
+        # otra codificación obtiene su propio digest.
+        digest = get_attachment_digest(attachments, "gpt-4o")
+
         # FASE 0: Análisis de consigna
-        assignment_analysis = phase0_analyze_assignment(topic, requirements, attachments)
+        assignment_analysis = phase0_analyze_assignment(topic, requirements, attachments, digest=digest)
         
         # FASE 1: Esquema respetando consigna
-        schema = phase1_analyze_and_outline(topic, requirements, attachments, language_hint, assignment_analysis)
+        schema = phase1_analyze_and_outline(topic, requirements, attachments, language_hint, assignment_analysis, digest=digest)
         
         # FASE 2: Redacción de secciones
-        section_texts = phase2_write_sections(schema, attachments, language_hint, assignment_analysis)
+        section_texts = phase2_write_sections(schema, attachments, language_hint, assignment_analysis, section_stats=section_stats, digest=digest)
         
         # Montar documento
         final_parts = []
-        for sec in ["Introducción", "Método", "Resultados", "Discusión", "Conclusiones"]:
+        for sec in PHASE2_SECTIONS:
             if sec in section_texts:
                 final_parts.append(f"## {sec}\n\n{section_texts[sec].strip()}\n")
         assembled = "\n".join(final_parts).strip()
         
         # FASE 3: Coherencia
-        final_text = phase3_coherence_pass(assembled, attachments, language_hint, assignment_analysis)
+        final_text = phase3_coherence_pass(assembled, attachments, language_hint, assignment_analysis, digest=digest)
         return final_text
     except Exception as e:
         return f"Error en generación por fases: {str(e)}"
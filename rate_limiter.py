@@ -0,0 +1,181 @@
+"""
+Limitador de tokens por minuto: ventana deslizante segura entre hilos y corutinas.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Deque, List, Optional
+
+
+WINDOW_SECONDS = 60.0
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset_duration(value) -> Optional[float]:
+    """Convierte valores como "6m0s", "1.5s" o "20ms" de las cabeceras x-ratelimit a segundos."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in parts)
+
+
+class TokenReservation:
+    """Reserva de tokens dentro de la ventana; se ajusta con el uso real."""
+
+    __slots__ = ("ts", "tokens")
+
+    def __init__(self, ts: float, tokens: int):
+        self.ts = ts
+        self.tokens = tokens
+
+
+class TokenRateLimiter:
+    """
+    Limita los tokens enviados por minuto con una ventana deslizante de 60 s.
+
+    Las reservas se guardan en un deque ordenado por tiempo y se mantiene la
+    suma acumulada, así que purgar y consultar el uso es O(1) amortizado. Un
+    único lock protege el estado: la instancia de módulo se comparte entre
+    todas las sesiones de Streamlit y los hilos de la Fase 2.
+    """
+
+    def __init__(self, tpm_limit: int = None):
+        self.tpm_limit = tpm_limit or int(os.getenv("OPENAI_TPM_LIMIT", "100000"))
+        self._window: Deque[TokenReservation] = deque()
+        self._used = 0
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        # Estado informado por el servidor (cabeceras x-ratelimit / 429)
+        self._server_remaining: Optional[int] = None
+        self._server_reset_at = 0.0
+        self._blocked_until = 0.0
+
+    # --- estado interno (llamar con el lock tomado) ---
+
+    def _purge(self, now: float):
+        while self._window and now - self._window[0].ts >= WINDOW_SECONDS:
+            self._used -= self._window.popleft().tokens
+
+    def _try_reserve(self, planned_tokens: int, now: float):
+        """Devuelve (reserva, 0) si hay hueco o (None, segundos de espera)."""
+        self._purge(now)
+        # Tras un 429 nadie envía hasta que venza el Retry-After
+        if now < self._blocked_until:
+            return None, self._blocked_until - now
+        # Si el servidor anunció menos margen del que creemos tener, manda el servidor
+        if self._server_remaining is not None and now < self._server_reset_at:
+            if planned_tokens > self._server_remaining:
+                return None, self._server_reset_at - now
+        # Una petición mayor que el límite solo pasa con la ventana vacía
+        if self._used + planned_tokens <= self.tpm_limit or not self._window:
+            res = TokenReservation(now, planned_tokens)
+            self._window.append(res)
+            self._used += planned_tokens
+            if self._server_remaining is not None and now < self._server_reset_at:
+                self._server_remaining -= planned_tokens
+            return res, 0.0
+        # Esperar a que expiren las reservas más antiguas que cubren el déficit
+        deficit = self._used + planned_tokens - self.tpm_limit
+        freed = 0
+        for res in self._window:
+            freed += res.tokens
+            if freed >= deficit:
+                return None, max(0.05, res.ts + WINDOW_SECONDS - now)
+        return None, max(0.05, self._window[-1].ts + WINDOW_SECONDS - now)
+
+    # --- API pública ---
+
+    def allow(self, planned_tokens: int) -> TokenReservation:
+        """Bloquea el hilo hasta que haya presupuesto y registra la reserva."""
+        with self._cond:
+            while True:
+                res, wait_s = self._try_reserve(planned_tokens, time.monotonic())
+                if res is not None:
+                    return res
+                # Se despierta antes si otra llamada devuelve presupuesto
+                self._cond.wait(timeout=wait_s)
+
+    async def allow_async(self, planned_tokens: int) -> TokenReservation:
+        """Versión `await` de `allow`: cede el bucle de eventos mientras espera."""
+        import asyncio
+
+        while True:
+            with self._lock:
+                res, wait_s = self._try_reserve(planned_tokens, time.monotonic())
+            if res is not None:
+                return res
+            await asyncio.sleep(min(wait_s, 1.0))
+
+    def reconcile(self, reservation: Optional[TokenReservation], actual_tokens: Optional[int]):
+        """
+        Sustituye los tokens planificados de una reserva por los reales.
+
+        Args:
+            reservation: Valor devuelto por `allow`/`allow_async`
+            actual_tokens: `usage.total_tokens` de la respuesta
+        """
+        if reservation is None or actual_tokens is None:
+            return
+        with self._cond:
+            now = time.monotonic()
+            self._purge(now)
+            delta = int(actual_tokens) - reservation.tokens
+            reservation.tokens = int(actual_tokens)
+            # Si la reserva ya salió de la ventana no cuenta en `_used`
+            if now - reservation.ts < WINDOW_SECONDS:
+                self._used += delta
+            if delta < 0:
+                self._cond.notify_all()
+
+    def update_from_headers(self, headers):
+        """
+        Ajusta el limitador con las cabeceras x-ratelimit-* de una respuesta.
+
+        `x-ratelimit-limit-tokens` rebaja el límite local si el real es menor y
+        `x-ratelimit-remaining-tokens` / `x-ratelimit-reset-tokens` acotan lo
+        que se puede enviar hasta el próximo reinicio del servidor.
+        """
+        if not headers:
+            return
+        limit = headers.get("x-ratelimit-limit-tokens")
+        remaining = headers.get("x-ratelimit-remaining-tokens")
+        reset_s = parse_reset_duration(headers.get("x-ratelimit-reset-tokens"))
+        with self._cond:
+            now = time.monotonic()
+            if limit is not None and str(limit).isdigit() and 0 < int(limit) < self.tpm_limit:
+                self.tpm_limit = int(limit)
+            if remaining is not None and str(remaining).isdigit() and reset_s is not None:
+                self._server_remaining = int(remaining)
+                self._server_reset_at = now + reset_s
+            self._cond.notify_all()
+
+    def penalize(self, retry_after_s: float):
+        """Bloquea todas las reservas durante `retry_after_s` segundos (tras un 429)."""
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + max(0.0, retry_after_s))
+
+    def used(self) -> int:
+        with self._lock:
+            self._purge(time.monotonic())
+            return self._used
+
+    def headroom(self) -> int:
+        """Tokens disponibles ahora mismo en la ventana."""
+        return max(0, self.tpm_limit - self.used())
+
+    def snapshot(self) -> List[int]:
+        with self._lock:
+            self._purge(time.monotonic())
+            return [res.tokens for res in self._window]
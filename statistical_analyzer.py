@@ -4,21 +4,119 @@ Análisis estadístico avanzado con énfasis en rigor científico.
 
 import pandas as pd
 import numpy as np
-from scipy import stats
-from typing import Dict, Tuple, Optional
+from functools import lru_cache
+from typing import Dict, List, Tuple, Optional, Union
 
+from dataset_store import dataset_columns, open_dataset
 
-def analyze_normality(df: pd.DataFrame, column: str) -> Dict:
+
+# Un DataFrame o la clave de un dataset del almacén columnar (ctx["dataset_key"])
+DataSource = Union[pd.DataFrame, str]
+
+
+def _stats():
+    """scipy.stats se importa en el primer análisis, no al cargar el módulo."""
+    from scipy import stats
+    return stats
+
+
+def _resolve(data: DataSource, columns: List[str]) -> pd.DataFrame:
+    """DataFrame con las columnas necesarias; los datasets del almacén se leen con memory-map."""
+    if isinstance(data, str):
+        return open_dataset(data, columns)
+    return data
+
+
+class GroupedData:
+    """
+    Índice de agrupación reutilizable entre pruebas de comparación de grupos.
+
+    Factoriza la columna de grupos una sola vez, descarta las filas con
+    grupo o valor perdido y guarda los valores ordenados por grupo, de modo
+    que cada grupo es un slice contiguo (sin máscaras booleanas por nivel).
+    Los grupos siguen el orden de aparición, como `unique()`.
+
+    Sin `values` solo se indexan los grupos: `row_mask` y `order` sirven
+    para ordenar igual cualquier matriz de columnas (ver `batch_group_tests`).
+    """
+
+    def __init__(self, groups: pd.Series, values: Optional[pd.Series] = None):
+        codes, labels = pd.factorize(groups)
+        keep = codes >= 0
+        if values is not None:
+            values = pd.to_numeric(values, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+            keep &= ~np.isnan(values)
+            values = values[keep]
+        codes = codes[keep]
+
+        # Solo los grupos con datos, recodificados 0..k-1
+        counts = np.bincount(codes, minlength=len(labels))
+        present = counts > 0
+        remap = np.cumsum(present) - 1
+        self.codes = remap[codes]
+        self.values = values
+        self.row_mask = keep
+        self.labels = list(labels[present])
+        self.counts = counts[present]
+        self.order = np.argsort(self.codes, kind="stable")
+        self.sorted_values = values[self.order] if values is not None else None
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)])
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, groups_col: str, values_col: str) -> "GroupedData":
+        return cls(df[groups_col], df[values_col])
+
+    @property
+    def n_groups(self) -> int:
+        return len(self.labels)
+
+    def group(self, i: int) -> np.ndarray:
+        """Valores del grupo i (vista, sin copia)."""
+        return self.sorted_values[self.offsets[i]:self.offsets[i + 1]]
+
+    def arrays(self) -> List[np.ndarray]:
+        return [self.group(i) for i in range(self.n_groups)]
+
+
+# Cada entrada guarda una copia de dos columnas del dataset: basta para
+# encadenar supuestos y prueba sobre las mismas variables
+_GROUPED_CACHE_MAX = 4
+
+
+@lru_cache(maxsize=_GROUPED_CACHE_MAX)
+def _grouped_from_store(key: str, groups_col: str, values_col: str) -> GroupedData:
+    # Los datasets del almacén son inmutables (clave = hash del contenido)
+    return GroupedData.from_frame(open_dataset(key, [groups_col, values_col]), groups_col, values_col)
+
+
+def grouped_data(data: Union[DataSource, GroupedData], groups_col: Optional[str] = None, values_col: Optional[str] = None) -> GroupedData:
+    """
+    GroupedData para (dataset, columna de grupos, columna de valores).
+
+    Con la clave de un dataset del almacén el resultado se cachea; con un
+    DataFrame se construye de nuevo (puede haber cambiado), así que conviene
+    crearlo una vez y pasarlo a todas las pruebas.
+    """
+    if isinstance(data, GroupedData):
+        return data
+    if isinstance(data, str):
+        return _grouped_from_store(data, groups_col, values_col)
+    return GroupedData.from_frame(data, groups_col, values_col)
+
+
+def analyze_normality(df: DataSource, column: str) -> Dict:
     """
     Prueba de normalidad usando Shapiro-Wilk y Kolmogorov-Smirnov.
     
     Args:
-        df: DataFrame
+        df: DataFrame o clave de dataset del almacén columnar
         column: Nombre de la columna
     
     Returns:
         Resultados de pruebas de normalidad
     """
+    stats = _stats()
+    df = _resolve(df, [column])
     data = df[column].dropna()
     
     shapiro_stat, shapiro_p = stats.shapiro(data)
@@ -31,22 +129,22 @@ def analyze_normality(df: pd.DataFrame, column: str) -> Dict:
     }
 
 
-def analyze_homogeneity(df: pd.DataFrame, groups_col: str, values_col: str) -> Dict:
+def analyze_homogeneity(df: Union[DataSource, GroupedData], groups_col: Optional[str] = None, values_col: Optional[str] = None) -> Dict:
     """
     Prueba de homocedasticidad de Levene.
     
     Args:
-        df: DataFrame
-        groups_col: Columna de grupos
-        values_col: Columna de valores
+        df: DataFrame, clave de dataset del almacén columnar o GroupedData
+        groups_col: Columna de grupos (no hace falta con GroupedData)
+        values_col: Columna de valores (no hace falta con GroupedData)
     
     Returns:
         Resultados de Levene
     """
-    groups = df[groups_col].unique()
-    group_data = [df[df[groups_col] == g][values_col].dropna().values for g in groups]
+    stats = _stats()
+    grouped = grouped_data(df, groups_col, values_col)
     
-    levene_stat, levene_p = stats.levene(*group_data)
+    levene_stat, levene_p = stats.levene(*grouped.arrays())
     
     return {
         "Estadístico de Levene": levene_stat,
@@ -75,24 +173,24 @@ def calculate_cohens_d(group1: np.ndarray, group2: np.ndarray) -> float:
     return d
 
 
-def t_test_independent(df: pd.DataFrame, groups_col: str, values_col: str) -> Dict:
+def t_test_independent(df: Union[DataSource, GroupedData], groups_col: Optional[str] = None, values_col: Optional[str] = None) -> Dict:
     """
     Prueba t de Student para muestras independientes.
     
     Args:
-        df: DataFrame
-        groups_col: Columna de grupos
-        values_col: Columna de valores
+        df: DataFrame, clave de dataset del almacén columnar o GroupedData
+        groups_col: Columna de grupos (no hace falta con GroupedData)
+        values_col: Columna de valores (no hace falta con GroupedData)
     
     Returns:
         Resultados de la prueba t
     """
-    groups = df[groups_col].unique()
-    if len(groups) != 2:
+    stats = _stats()
+    grouped = grouped_data(df, groups_col, values_col)
+    if grouped.n_groups != 2:
         return {"error": "Esta prueba requiere exactamente 2 grupos"}
     
-    group1 = df[df[groups_col] == groups[0]][values_col].dropna().values
-    group2 = df[df[groups_col] == groups[1]][values_col].dropna().values
+    group1, group2 = grouped.group(0), grouped.group(1)
     
     t_stat, p_value = stats.ttest_ind(group1, group2)
     cohens_d = calculate_cohens_d(group1, group2)
@@ -115,50 +213,80 @@ def t_test_independent(df: pd.DataFrame, groups_col: str, values_col: str) -> Di
     }
 
 
-def anova_test(df: pd.DataFrame, groups_col: str, values_col: str) -> Dict:
+def _one_way_anova(codes: np.ndarray, values: np.ndarray) -> Dict:
     """
-    ANOVA de una vía.
-    
+    Sumas de cuadrados de un ANOVA de una vía en una pasada con np.bincount.
+
     Args:
-        df: DataFrame
-        groups_col: Columna de grupos
-        values_col: Columna de valores
-    
-    Returns:
-        Resultados de ANOVA
+        codes: Código de grupo de cada observación (0..k-1, sin perdidos)
+        values: Valores (sin perdidos)
     """
-    groups = df[groups_col].unique()
-    group_data = [df[df[groups_col] == g][values_col].dropna().values for g in groups]
-    
-    f_stat, p_value = stats.f_oneway(*group_data)
-    
-    # Eta-cuadrado (tamaño del efecto)
-    grand_mean = np.concatenate(group_data).mean()
-    ss_between = sum(len(g) * (np.mean(g) - grand_mean)**2 for g in group_data)
-    ss_total = sum((x - grand_mean)**2 for g in group_data for x in g)
+    stats = _stats()
+    n_per_group = np.bincount(codes)
+    present = n_per_group > 0
+    k = int(present.sum())
+    n = len(values)
+    if k < 2 or n <= k:
+        return {"error": "ANOVA requiere al menos 2 grupos con datos y más observaciones que grupos"}
+
+    sums = np.bincount(codes, weights=values)
+    means = np.divide(sums, n_per_group, out=np.zeros_like(sums), where=present)
+    grand_mean = values.mean()
+    ss_between = float(np.sum(n_per_group * (means - grand_mean) ** 2))
+    ss_within = float(np.sum((values - means[codes]) ** 2))
+    ss_total = ss_between + ss_within
+
+    df_between, df_within = k - 1, n - k
+    ms_within = ss_within / df_within
+    f_stat = (ss_between / df_between) / ms_within if ms_within > 0 else np.inf
+    p_value = float(stats.f.sf(f_stat, df_between, df_within))
     eta_squared = ss_between / ss_total if ss_total > 0 else 0
-    
+    omega_squared = (ss_between - df_between * ms_within) / (ss_total + ms_within) if ss_total > 0 else 0
+
     return {
         "F-estadístico": f_stat,
         "p-valor": p_value,
+        "gl": (df_between, df_within),
         "Eta-cuadrado": eta_squared,
+        "Omega-cuadrado": max(omega_squared, 0.0),
         "Significancia": "Significativo" if p_value < 0.05 else "No significativo",
         "Tamaño del efecto": _interpret_eta_squared(eta_squared)
     }
 
 
-def correlation_analysis(df: pd.DataFrame, col1: str, col2: str) -> Dict:
+def anova_test(df: Union[DataSource, GroupedData], groups_col: Optional[str] = None, values_col: Optional[str] = None) -> Dict:
+    """
+    ANOVA de una vía.
+
+    Se excluyen las filas con grupo o valor perdido. Las sumas de cuadrados
+    se calculan en una sola pasada (códigos de `pd.factorize` + np.bincount).
+    
+    Args:
+        df: DataFrame, clave de dataset del almacén columnar o GroupedData
+        groups_col: Columna de grupos (no hace falta con GroupedData)
+        values_col: Columna de valores (no hace falta con GroupedData)
+    
+    Returns:
+        Resultados de ANOVA (F, p, grados de libertad, eta² y omega²)
+    """
+    grouped = grouped_data(df, groups_col, values_col)
+    return _one_way_anova(grouped.codes, grouped.values)
+
+
+def correlation_analysis(df: DataSource, col1: str, col2: str) -> Dict:
     """
     Análisis de correlación de Pearson.
     
     Args:
-        df: DataFrame
+        df: DataFrame o clave de dataset del almacén columnar
         col1: Primera columna
         col2: Segunda columna
     
     Returns:
         Resultados de correlación
     """
+    stats = _stats()
+    df = _resolve(df, [col1, col2])
     data1 = df[col1].dropna()
     data2 = df[col2].dropna()
     
@@ -185,6 +313,155 @@ def correlation_analysis(df: pd.DataFrame, col1: str, col2: str) -> Dict:
     }
 
 
+def adjust_pvalues(p_values: np.ndarray, method: str = "holm") -> np.ndarray:
+    """
+    Corrección por comparaciones múltiples (vectorizada).
+
+    Args:
+        p_values: p-valores sin corregir (los NaN se ignoran y se conservan)
+        method: 'holm' (Holm-Bonferroni, FWER) o 'fdr_bh' (Benjamini-Hochberg, FDR)
+
+    Returns:
+        p-valores ajustados, en el mismo orden
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    adjusted = np.full_like(p_values, np.nan)
+    valid = ~np.isnan(p_values)
+    p = p_values[valid]
+    m = len(p)
+    if m == 0:
+        return adjusted
+    order = np.argsort(p)
+    ranked = p[order]
+    if method == "holm":
+        adj = np.maximum.accumulate((m - np.arange(m)) * ranked)
+    elif method == "fdr_bh":
+        adj = np.minimum.accumulate((ranked * m / np.arange(1, m + 1))[::-1])[::-1]
+    else:
+        raise ValueError(f"Método de corrección no soportado: {method}")
+    result = np.empty(m)
+    result[order] = np.minimum(adj, 1.0)
+    adjusted[valid] = result
+    return adjusted
+
+
+def _group_moments(grouped: GroupedData, matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    n, media y suma de cuadrados centrada por grupo y columna (k × m).
+
+    Los valores ya vienen ordenados por grupo: cada estadístico es un
+    np.add.reduceat sobre los tramos contiguos de cada grupo.
+    """
+    valid = ~np.isnan(matrix)
+    starts = grouped.offsets[:-1]
+    counts = np.add.reduceat(valid, starts, axis=0).astype(float)
+    sums = np.add.reduceat(np.where(valid, matrix, 0.0), starts, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    centered = np.where(valid, matrix - np.repeat(means, grouped.counts, axis=0), 0.0)
+    ss = np.add.reduceat(centered ** 2, starts, axis=0)
+    return counts, means, ss
+
+
+def batch_group_tests(
+    df: DataSource,
+    groups_col: str,
+    value_cols: List[str],
+    test: str = "auto",
+    correction: str = "holm",
+    alpha: float = 0.05,
+) -> pd.DataFrame:
+    """
+    Misma prueba de comparación de grupos sobre muchas columnas a la vez.
+
+    Con 2 grupos se aplica la t de Student (varianzas iguales, como
+    `t_test_independent`) y con más, el ANOVA de una vía (como `anova_test`).
+    Todas las columnas se procesan juntas como una matriz: los perdidos se
+    excluyen columna a columna y los p-valores se corrigen al final.
+
+    Args:
+        df: DataFrame o clave de dataset del almacén columnar
+        groups_col: Columna de grupos
+        value_cols: Columnas de resultado (ítems, escalas...)
+        test: 'auto', 't' o 'anova'
+        correction: 'holm' o 'fdr_bh'
+        alpha: Nivel de significación tras la corrección
+
+    Returns:
+        DataFrame con una fila por columna: variable, prueba, n, gl,
+        estadístico, p-valor, p-ajustado, Significancia, tamaño del efecto
+        (d de Cohen o eta²/omega²) e interpretación
+    """
+    stats = _stats()
+    value_cols = list(dict.fromkeys(value_cols))
+    data = _resolve(df, [groups_col, *value_cols])
+    # Índice de grupos compartido por todas las columnas; los perdidos de cada columna se excluyen después
+    grouped = GroupedData(data[groups_col])
+    matrix = data[value_cols].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+    matrix = matrix[grouped.row_mask][grouped.order]
+    labels, k = grouped.labels, grouped.n_groups
+
+    if test == "auto":
+        test = "t" if k == 2 else "anova"
+    if test == "t" and k != 2:
+        raise ValueError("La prueba t requiere exactamente 2 grupos")
+    if k < 2:
+        raise ValueError("Se necesitan al menos 2 grupos con datos")
+
+    counts, means, ss = _group_moments(grouped, matrix)
+    n_total = counts.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if test == "t":
+            n1, n2 = counts
+            dof = n1 + n2 - 2
+            pooled_var = (ss[0] + ss[1]) / dof
+            diff = means[0] - means[1]
+            statistic = diff / np.sqrt(pooled_var * (1 / n1 + 1 / n2))
+            p_values = 2 * stats.t.sf(np.abs(statistic), dof)
+            result = pd.DataFrame({
+                "variable": value_cols,
+                "prueba": "t de Student",
+                "n": n_total.astype(int),
+                "gl": dof.astype(int),
+                "estadístico": statistic,
+                "p-valor": p_values,
+                f"media {labels[0]}": means[0],
+                f"media {labels[1]}": means[1],
+                "d de Cohen": diff / np.sqrt(pooled_var),
+            })
+            result["Tamaño del efecto"] = [_interpret_cohens_d(d) if np.isfinite(d) else None for d in result["d de Cohen"]]
+        else:
+            present = counts > 0
+            k_col = present.sum(axis=0)
+            grand_mean = np.nansum(counts * np.nan_to_num(means), axis=0) / n_total
+            ss_between = np.nansum(counts * (np.nan_to_num(means) - grand_mean) ** 2, axis=0)
+            ss_within = ss.sum(axis=0)
+            ss_total = ss_between + ss_within
+            df_between, df_within = k_col - 1, n_total - k_col
+            ms_within = ss_within / df_within
+            statistic = (ss_between / df_between) / ms_within
+            p_values = stats.f.sf(statistic, df_between, df_within)
+            eta_squared = ss_between / ss_total
+            omega_squared = np.maximum((ss_between - df_between * ms_within) / (ss_total + ms_within), 0.0)
+            result = pd.DataFrame({
+                "variable": value_cols,
+                "prueba": "ANOVA de una vía",
+                "n": n_total.astype(int),
+                "gl": list(zip(df_between.astype(int), df_within.astype(int))),
+                "estadístico": statistic,
+                "p-valor": p_values,
+                "Eta-cuadrado": eta_squared,
+                "Omega-cuadrado": omega_squared,
+            })
+            result["Tamaño del efecto"] = [_interpret_eta_squared(e) if np.isfinite(e) else None for e in eta_squared]
+
+    result.insert(result.columns.get_loc("p-valor") + 1, "p-ajustado", adjust_pvalues(result["p-valor"].to_numpy(), correction))
+    result.insert(result.columns.get_loc("p-ajustado") + 1, "Significancia", np.where(
+        result["p-ajustado"] < alpha, "Significativo", "No significativo"
+    ))
+    return result
+
+
 def _interpret_cohens_d(d: float) -> str:
     """Interpreta d de Cohen según criterios convencionales."""
     d = abs(d)
@@ -223,17 +500,19 @@ def _interpret_correlation(r: float) -> str:
         return "Grande"
 
 
-def generate_statistical_report(df: pd.DataFrame, numeric_cols: list) -> str:
+def generate_statistical_report(df: DataSource, numeric_cols: list) -> str:
     """
     Genera un reporte estadístico completo.
     
     Args:
-        df: DataFrame
+        df: DataFrame o clave de dataset del almacén columnar
         numeric_cols: Lista de columnas numéricas a analizar
     
     Returns:
         Reporte en texto
     """
+    available = dataset_columns(df) if isinstance(df, str) else list(df.columns)
+    df = _resolve(df, [c for c in numeric_cols if c in available])
     report = "REPORTE ESTADÍSTICO DESCRIPTIVO\n"
     report += "=" * 50 + "\n\n"
     
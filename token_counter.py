@@ -0,0 +1,221 @@
+"""
+Contabilidad de tokens con caché: codificadores por modelo y conteos memoizados.
+"""
+
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from config import DEFAULT_MODEL, TOKEN_COUNT_CACHE_SIZE
+
+
+# Prefijo de modelo -> codificación. Se evalúa en orden: los prefijos más
+# específicos deben ir primero (gpt-4o antes que gpt-4).
+MODEL_ENCODINGS = [
+    ("gpt-4o", "o200k_base"),
+    ("o1", "o200k_base"),
+    ("o3", "o200k_base"),
+    ("gpt-4", "cl100k_base"),
+    ("gpt-3.5", "cl100k_base"),
+]
+
+FALLBACK_ENCODING = "cl100k_base"
+
+# Sobrecoste aproximado por mensaje en el formato chat (rol + separadores)
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# Coste de las imágenes en visión (gpt-4o): base + teselas de 512 px en detalle alto
+VISION_BASE_TOKENS = 85
+VISION_TILE_TOKENS = 170
+VISION_TILE_PX = 512
+VISION_MAX_SIDE_PX = 2048
+VISION_SHORT_SIDE_PX = 768
+
+
+def encoding_name_for_model(model: Optional[str] = None) -> str:
+    """Devuelve el nombre de la codificación de tiktoken que usa un modelo."""
+    model = model or DEFAULT_MODEL
+    for prefix, name in MODEL_ENCODINGS:
+        if model.startswith(prefix):
+            return name
+    return FALLBACK_ENCODING
+
+
+@lru_cache(maxsize=None)
+def get_encoding(name: str = FALLBACK_ENCODING):
+    """
+    Carga un codificador una sola vez por proceso (tiktoken se importa en el primer uso).
+
+    Devuelve None si no se puede cargar (p. ej. sin red para descargarlo); el
+    fallo también queda en caché, así que no se reintenta en cada conteo y los
+    llamadores usan la estimación len // 4.
+    """
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(name)
+    except Exception:
+        return None
+
+
+def encoding_for_model(model: Optional[str] = None):
+    return get_encoding(encoding_name_for_model(model))
+
+
+class TokenCountCache:
+    """LRU acotada de conteos, indexada por (codificación, hash del contenido)."""
+
+    def __init__(self, maxsize: int = TOKEN_COUNT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[tuple, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(encoding_name: str, text: str) -> tuple:
+        digest = hashlib.blake2b(text.encode("utf-8", errors="ignore"), digest_size=16).digest()
+        return encoding_name, digest
+
+    def get(self, key: tuple) -> Optional[int]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: tuple, value: int):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+count_cache = TokenCountCache()
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Cuenta tokens de un texto con la codificación del modelo (memoizado)."""
+    text = text or ""
+    if not text:
+        return 0
+    name = encoding_name_for_model(model)
+    key = TokenCountCache.key(name, text)
+    cached = count_cache.get(key)
+    if cached is not None:
+        return cached
+    enc = get_encoding(name)
+    if enc is None:
+        return len(text) // 4
+    n = len(enc.encode(text))
+    count_cache.put(key, n)
+    return n
+
+
+def _message_text(message: Dict) -> str:
+    content = message.get("content", "")
+    if isinstance(content, list):
+        return "\n".join(
+            part.get("text", "") for part in content
+            if isinstance(part, dict) and part.get("type") == "text"
+        )
+    return str(content or "")
+
+
+def count_message_tokens(messages: List[Dict], model: Optional[str] = None, include_overhead: bool = False) -> int:
+    """
+    Cuenta los tokens de texto de una lista de mensajes.
+
+    Args:
+        messages: Mensajes en formato OpenAI
+        model: Modelo destino (determina la codificación)
+        include_overhead: Suma el sobrecoste por mensaje del formato chat
+
+    Returns:
+        Total de tokens
+    """
+    total = sum(count_tokens(_message_text(m), model) for m in messages)
+    if include_overhead and messages:
+        total += TOKENS_PER_MESSAGE * len(messages) + TOKENS_PER_REPLY
+    return total
+
+
+def vision_image_size(width: int, height: int) -> tuple:
+    """Tamaño al que el proveedor reescala una imagen en detalle alto."""
+    scale = min(1.0, VISION_MAX_SIDE_PX / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, VISION_SHORT_SIDE_PX / min(width, height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def estimate_vision_tokens(width: int, height: int, detail: str = "high") -> int:
+    """
+    Tokens de entrada estimados de una imagen.
+
+    En detalle bajo el coste es fijo; en alto, la imagen se ajusta a 2048 px y
+    su lado corto a 768 px, y se cobra por cada tesela de 512×512.
+    """
+    if detail == "low" or width <= 0 or height <= 0:
+        return VISION_BASE_TOKENS
+    width, height = vision_image_size(width, height)
+    tiles = math.ceil(width / VISION_TILE_PX) * math.ceil(height / VISION_TILE_PX)
+    return VISION_BASE_TOKENS + VISION_TILE_TOKENS * tiles
+
+
+def count_tokens_bulk(conversations: List[List[Dict]], model: Optional[str] = None, include_overhead: bool = False) -> List[int]:
+    """
+    Cuenta varias listas de mensajes de una vez.
+
+    Los textos repetidos entre conversaciones (prompt de sistema, resumen de
+    adjuntos) se codifican una sola vez gracias a la caché.
+    """
+    return [count_message_tokens(msgs, model, include_overhead) for msgs in conversations]
+
+
+def truncate_text_to_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """Recorta un texto a `max_tokens` tokens de la codificación del modelo."""
+    text = text or ""
+    name = encoding_name_for_model(model)
+    key = TokenCountCache.key(name, text)
+    cached = count_cache.get(key)
+    if cached is not None and cached <= max_tokens:
+        return text
+    enc = get_encoding(name)
+    if enc is None:
+        return text[:max_tokens * 4]
+    ids = enc.encode(text)
+    if cached is None:
+        count_cache.put(key, len(ids))
+    if len(ids) <= max_tokens:
+        return text
+    return enc.decode(ids[:max_tokens])
+
+
+def tail_text_to_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """Devuelve los últimos `max_tokens` tokens de un texto."""
+    text = text or ""
+    enc = encoding_for_model(model)
+    if enc is None:
+        return text[-max_tokens * 4:] if max_tokens > 0 else ""
+    ids = enc.encode(text)
+    if len(ids) <= max_tokens:
+        return text
+    return enc.decode(ids[-max_tokens:])